@@ -2,21 +2,52 @@ import dash
 import dash_bootstrap_components as dbc
 import dash_core_components as dcc
 import dash_html_components as html
-from dash.dependencies import Input, Output, State
+from dash.dependencies import (
+    ALL, MATCH, ClientsideFunction, Input, Output, State)
+from dash.exceptions import PreventUpdate
 import flask
+from os import environ
 import pandas as pd
 
 from config import config, get_teams_from_file
+from database.mongo import get_client
 from views import (
-    Forecast, Metrics, Sprints, Sprint)
+    Forecast, Metrics, PortfolioForecast, Sprints, Sprint, SprintNotes,
+    TeamMetrics)
 
 
 config.set('teams', get_teams_from_file())
+config.set(
+    'db',
+    environ.get('DB_HOST', 'localhost'),
+    int(environ.get('DB_PORT', 27017)),
+    environ.get('DB_USERNAME', 'root'),
+    environ.get('DB_PASSWORD', 'rootpassword'),
+    cache_ttl=int(environ.get('DB_CACHE_TTL', 300)),
+    cache_size=int(environ.get('DB_CACHE_SIZE', 256)),
+    max_pool_size=int(environ.get('DB_MAX_POOL_SIZE', 100)),
+    min_pool_size=int(environ.get('DB_MIN_POOL_SIZE', 0)),
+    wait_queue_timeout_ms=(
+        int(environ['DB_WAIT_QUEUE_TIMEOUT_MS'])
+        if 'DB_WAIT_QUEUE_TIMEOUT_MS' in environ else None),
+    server_selection_timeout_ms=int(
+        environ.get('DB_SERVER_SELECTION_TIMEOUT_MS', 30000)),
+    read_preference=environ.get('DB_READ_PREFERENCE', 'primary'),
+    max_staleness_seconds=int(environ.get('DB_MAX_STALENESS_SECONDS', -1)),
+    issue_layout=environ.get('DB_ISSUE_LAYOUT', 'embedded'),
+    persist_forecasts=environ.get('DB_PERSIST_FORECASTS') == 'true',
+    )
 
 pd.options.mode.chained_assignment = None
 
 server = flask.Flask(__name__)
 
+
+@server.route('/cache-stats')
+def cache_stats():
+    return flask.jsonify(get_client().cache.stats())
+
+
 app = dash.Dash(
     'Limejump Tech Metrics',
     server=server,
@@ -37,6 +68,7 @@ layout_index = html.Div([
     dbc.Nav([
         dbc.NavItem(dbc.NavLink('Sprints', href='/sprints')),
         dbc.NavItem(dbc.NavLink('Forecasts', href='/forecasts')),
+        dbc.NavItem(dbc.NavLink('Portfolio', href='/portfolio')),
         dbc.NavItem(dbc.NavLink('Metrics', href='/metrics')),
     ], pills=True)
 ])
@@ -44,7 +76,7 @@ layout_index = html.Div([
 
 layout_sprints = html.Div(children=[
     html.Div([
-        html.Div(children=False, id='notes-editability', hidden=True),
+        dcc.Store(id='goal-completion-saved'),
         dbc.Row([dbc.Col([layout_index])]),
         dbc.Row([dbc.Col([
             html.Div([html.Label([
@@ -94,6 +126,24 @@ layout_forecasting = html.Div([
     ])
 
 
+layout_portfolio = html.Div([
+    html.Div([
+        dbc.Row([dbc.Col([layout_index])]),
+        dbc.Row([
+            dbc.Col(
+                PortfolioForecast.render_inputs(
+                    team.name for team in config.get('teams').teams),
+                width=3, className='bg-info',
+                style={'font-size': '12px'}),
+            dbc.Col(
+                html.Div(
+                    id='portfolio-forecast',
+                    className='container-fluid'),
+                width=9)
+        ])], className='container-fluid')
+    ])
+
+
 def layout_metrics():
     return html.Div([
         layout_index,
@@ -112,7 +162,8 @@ app.validation_layout = html.Div([
     url_bar_and_content_div,
     layout_index,
     layout_sprints,
-    layout_forecasting
+    layout_forecasting,
+    layout_portfolio
 ])
 
 
@@ -124,6 +175,8 @@ def display_page(pathname):
         return layout_sprints
     elif pathname == "/forecasts":
         return layout_forecasting
+    elif pathname == "/portfolio":
+        return layout_portfolio
     elif pathname == "/metrics":
         return layout_metrics()
     else:
@@ -132,63 +185,168 @@ def display_page(pathname):
 
 @app.callback(
     [
-        Output('sprints', 'children'),
         Output('sprint-dropdown', 'options'),
-        Output('notes-editability', 'children')
+        Output('sprint-dropdown', 'value')
+    ],
+    [Input(component_id='teams-dropdown', component_property="value")],
+    [State('sprint-dropdown', 'value')])
+def select_team(team_name, sprint_id):
+    # if someone deletes the team selection we'll recieve None
+    if team_name is None:
+        team_name = team_data_options[0]['value']
+    sprints = Sprints(team_name)
+    # sprint_id can alreaedy be set when we select a new team
+    # so we may need to override it to the teams' default.
+    if sprint_id not in sprints.sprint_ids:
+        sprint_id = sprints.default_select
+    return sprints.select_options, sprint_id
+
+
+@app.callback(
+    Output('sprints', 'children'),
+    [Input(component_id='sprint-dropdown', component_property="value")])
+def select_sprint(sprint_id):
+    # The dropdown starts empty, until a team's sprints are loaded
+    if not sprint_id:
+        raise PreventUpdate
+    return Sprint(sprint_id).render()
+
+
+@app.callback(
+    Output('goal-completion-saved', 'data'),
+    [Input(component_id='goal-completion-toggle', component_property="on")],
+    [State('sprint-dropdown', 'value')],
+    prevent_initial_call=True)
+def toggle_goal_completion(goal_complete, sprint_id):
+    Sprint.update_goal_completion(sprint_id, goal_complete)
+    return goal_complete
+
+
+app.clientside_callback(
+    ClientsideFunction(namespace='notes', function_name='toggle_mode'),
+    [
+        Output('notes-read', 'style'),
+        Output('notes-edit', 'style')
     ],
     [
-        # Sprint selectors
-        Input(component_id='teams-dropdown', component_property="value"),
-        Input(component_id='sprint-dropdown', component_property="value"),
-        # Sprint modifiers, accessible via users
-        Input(component_id='goal-completion-toggle', component_property="on"),
         Input(component_id='edit-notes', component_property="n_clicks"),
         Input(component_id='submit-notes', component_property="n_clicks"),
     ],
+    [State('notes-content', 'value')],
+    prevent_initial_call=True)
+
+
+@app.callback(
+    Output('notes-markdown', 'children'),
+    [Input(component_id='submit-notes', component_property="n_clicks")],
     [
-        State('notes-editability', 'children'),
+        State('sprint-dropdown', 'value'),
         State('notes-content', 'value')
-    ])
-def change_sprint(
-        team_name, sprint_id,
-        goal_complete, edit_notes, submit_notes,
-        notes_editability, notes_content):
-    # if someone deletes the team selection we'll recieve None
-    if team_name is None:
-        team_name = team_data_options[0]['value']
+    ],
+    prevent_initial_call=True)
+def save_notes(submit_notes, sprint_id, notes_content):
+    # FIXME: may want to handle this using validation using
+    # FormFeedback
+    if not notes_content:
+        raise PreventUpdate
+    SprintNotes.save_notes(sprint_id, notes_content)
+    return notes_content
 
-    if edit_notes:
-        notes_editability = True
-    if submit_notes:
-        notes_editability = False
 
-    sprints = Sprints(team_name)
-    # sprint_id can alreaedy be set when we select a new team
-    # so we may need to override it to the teams' default.
-    if sprint_id in sprints.sprint_ids:
-        sprint = Sprint(sprint_id, notes_editability)
-    else:
-        sprint = Sprint(sprints.default_select, notes_editability)
+@app.callback(
+    [
+        Output('sprint-details', 'data'),
+        Output('sprint-details', 'page_count')
+    ],
+    [
+        Input('sprint-details', 'page_current'),
+        Input('sprint-details', 'page_size'),
+        Input('sprint-details', 'sort_by'),
+        Input('sprint-details', 'filter_query')
+    ],
+    [State('sprint-dropdown', 'value')],
+    prevent_initial_call=True)
+def page_sprint_details(
+        page_current, page_size, sort_by, filter_query, sprint_id):
+    return Sprint.details_page(
+        sprint_id, page_current, page_size, sort_by, filter_query)
+
 
-    triggers = dash.callback_context.triggered
-    if triggers:
-        param = triggers.pop()['prop_id']
-        if param == 'goal-completion-toggle.on':
-            sprint.update_goal_completion(goal_complete)
-        elif param == 'submit-notes.n_clicks':
-            sprint.save_notes(notes_content)
+app.clientside_callback(
+    ClientsideFunction(namespace='metrics', function_name='when_visible'),
+    [
+        Output({'type': 'metrics-visible', 'team': MATCH}, 'data'),
+        Output({'type': 'metrics-poll', 'team': MATCH}, 'disabled')
+    ],
+    [Input({'type': 'metrics-poll', 'team': MATCH}, 'n_intervals')],
+    [State({'type': 'metrics-poll', 'team': MATCH}, 'id')],
+    prevent_initial_call=True)
 
-    return sprint.render(), sprints.select_options, notes_editability
+
+@app.callback(
+    Output({'type': 'metrics-panel', 'team': MATCH}, 'children'),
+    [Input({'type': 'metrics-visible', 'team': MATCH}, 'data')],
+    [State({'type': 'metrics-visible', 'team': MATCH}, 'id')],
+    prevent_initial_call=True)
+def load_team_metrics(visible, panel_id):
+    # A request per team, so the panels are drawn in parallel
+    if not visible:
+        raise PreventUpdate
+    return TeamMetrics(panel_id['team']).render()
 
 
 @app.callback(
     Output("forecast", "children"),
     [
         Input(component_id="teams-dropdown", component_property="value"),
-        Input(component_id='issues-input', component_property='value')
+        Input(component_id='issues-input', component_property='value'),
+        Input(component_id='forecast-mode', component_property='value')
     ])
-def update_estimate_graph(team_name, remaining_issues):
-    return Forecast(team_name, remaining_issues).render()
+def update_estimate_graph(team_name, remaining_issues, mode):
+    return Forecast(team_name, remaining_issues, mode).render()
+
+
+@app.callback(
+    Output('forecast-job-id', 'data'),
+    [Input('forecast-run', 'n_clicks')],
+    [
+        State('teams-dropdown', 'value'),
+        State('issues-input', 'value'),
+        State('forecast-mode', 'value')
+    ],
+    prevent_initial_call=True)
+def run_forecast_job(n_clicks, team_name, remaining_issues, mode):
+    job_id = Forecast(team_name, remaining_issues, mode).submit_job()
+    if job_id is None:
+        raise PreventUpdate
+    return job_id
+
+
+@app.callback(
+    [
+        Output('forecast-job', 'children'),
+        Output('forecast-job-poll', 'disabled')
+    ],
+    [
+        Input('forecast-job-poll', 'n_intervals'),
+        Input('forecast-job-id', 'data')
+    ])
+def poll_forecast_job(n_intervals, job_id):
+    return Forecast.poll_job(job_id)
+
+
+@app.callback(
+    Output('portfolio-forecast', 'children'),
+    [
+        Input({'type': 'portfolio-issues', 'team': ALL}, 'value'),
+        Input('portfolio-mode', 'value')
+    ],
+    [State({'type': 'portfolio-issues', 'team': ALL}, 'id')])
+def update_portfolio_forecast(remaining_issues, mode, input_ids):
+    return PortfolioForecast({
+        input_id['team']: remaining
+        for input_id, remaining in zip(input_ids, remaining_issues)
+    }, mode).render()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,21 @@
+// Marks a Metrics panel visible once it has been scrolled into view, so
+// that teams further down the page are only drawn if they are looked at.
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    metrics: {
+        when_visible: function(n_intervals, poll_id) {
+            // Dash's DOM id for a pattern matching component, keys sorted
+            const panel = document.getElementById(JSON.stringify(
+                {team: poll_id.team, type: 'metrics-panel'}));
+            if (panel) {
+                const rect = panel.getBoundingClientRect();
+                if (rect.top < window.innerHeight && rect.bottom > 0) {
+                    // Drawn once, the poll is no longer needed
+                    return [true, true];
+                }
+            }
+            return [
+                window.dash_clientside.no_update,
+                window.dash_clientside.no_update];
+        }
+    }
+});
@@ -0,0 +1,16 @@
+// Switches the sprint notes between reading and editing in the browser,
+// both are always rendered so only saving goes back to the server.
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    notes: {
+        toggle_mode: function(edit_clicks, submit_clicks, notes) {
+            const triggered = dash_clientside.callback_context.triggered.map(
+                trigger => trigger.prop_id);
+            // Saving empty notes keeps the editor open
+            const editing = (
+                triggered.includes('edit-notes.n_clicks') || !notes);
+            const show = {'display': 'block'};
+            const hide = {'display': 'none'};
+            return editing ? [hide, show] : [show, hide];
+        }
+    }
+});
@@ -436,6 +436,8 @@ class Sprint:
             "state": self.state,
             "start": self.start,
             "end": self.end,
+            "throughput": len(
+                [i for i in issues if i['finished_in_sprint']]),
             "issues": issues}
 
     def _issue_to_mongo(self, issue):
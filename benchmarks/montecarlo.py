@@ -0,0 +1,71 @@
+""" Compare the previous pure python Monte Carlo forecast with the
+NumPy engines in models.forecast, summing issue cycle times or
+counting sprints of throughput.
+
+    PYTHONPATH=. python benchmarks/montecarlo.py [--issues 300]
+"""
+import argparse
+import random
+import timeit
+
+import numpy as np
+import pandas as pd
+
+from models.forecast import (
+    SPRINT_DAYS, MonteCarloResult, simulate_days_taken,
+    simulate_sprints_taken)
+
+# Issues finished in each of the last six sprints
+THROUGHPUT_POOL = [9, 14, 6, 11, 12, 8]
+
+
+def python_montecarlo(pool, num_issues, simulations=1000):
+    records = []
+    for simulation in range(simulations):
+        days_taken = sum([
+            random.choice(pool)
+            for _ in range(num_issues)])
+        records.append({
+            "simulation": simulation,
+            "days_taken": days_taken})
+    df = pd.DataFrame.from_records(
+        records).sort_values('days_taken').reset_index(drop=True)
+    return {
+        percent: float(df['days_taken'].quantile(percent / 100))
+        for percent in (50, 60, 70, 80)}
+
+
+def numpy_montecarlo(pool, num_issues, simulations=1000):
+    return MonteCarloResult.from_totals(
+        simulate_days_taken(pool, num_issues, simulations)).percentiles
+
+
+def throughput_montecarlo(pool, num_issues, simulations=1000):
+    return MonteCarloResult.from_totals(SPRINT_DAYS * simulate_sprints_taken(
+        THROUGHPUT_POOL, num_issues, simulations)).percentiles
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--issues', type=int, default=300)
+    parser.add_argument('--simulations', type=int, default=1000)
+    parser.add_argument('--pool', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    pool = np.random.default_rng(0).gamma(2, 3, args.pool).round().tolist()
+    print(
+        f'{args.simulations} simulations of {args.issues} issues, '
+        f'pool of {args.pool}')
+    for name, fn in [
+            ('python', python_montecarlo),
+            ('numpy', numpy_montecarlo),
+            ('throughput', throughput_montecarlo)]:
+        best = min(timeit.repeat(
+            lambda: fn(pool, args.issues, args.simulations),
+            number=1, repeat=args.repeat))
+        print(f'{name:>10}: {best * 1000:.1f}ms {fn(pool, args.issues)}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+""" Time a portfolio forecast for many teams, run one team after another
+and across a process pool.
+
+    PYTHONPATH=. python benchmarks/portfolio.py [--teams 20]
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import timeit
+
+import numpy as np
+
+from models.forecast import (
+    CYCLE_TIME, MODES, TeamSimulation, simulate_portfolio)
+
+
+def mk_teams(num_teams, num_issues, pool_size, mode):
+    rng = np.random.default_rng(0)
+    return {
+        f'team {i}': TeamSimulation(
+            pool=(
+                rng.gamma(2, 3, pool_size).round() if mode == CYCLE_TIME
+                else rng.integers(4, 15, 6)),
+            num_issues=num_issues)
+        for i in range(num_teams)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--teams', type=int, default=20)
+    parser.add_argument('--issues', type=int, default=300)
+    parser.add_argument('--simulations', type=int, default=10000)
+    parser.add_argument('--pool', type=int, default=2000)
+    parser.add_argument('--mode', choices=list(MODES), default=CYCLE_TIME)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    teams = mk_teams(args.teams, args.issues, args.pool, args.mode)
+    print(
+        f'{args.teams} teams, {args.simulations} simulations of '
+        f'{args.issues} issues, {args.mode} mode')
+    with ProcessPoolExecutor() as executor:
+        # start the workers before timing
+        simulate_portfolio(teams, 10, args.mode, executor=executor)
+        for name, pool in [('serial', None), ('processes', executor)]:
+            best = min(timeit.repeat(
+                lambda: simulate_portfolio(
+                    teams, args.simulations, args.mode, seed=1,
+                    executor=pool),
+                number=1, repeat=args.repeat))
+            result = simulate_portfolio(
+                teams, args.simulations, args.mode, seed=1, executor=pool)
+            print(
+                f'{name:>10}: {best * 1000:.1f}ms '
+                f'{result.joint.percentiles}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+""" Compare building the sprint performance report rows a sprint at a
+time with the vectorised reports.utils.mk_sprint_summaries_df.
+
+    PYTHONPATH=. python benchmarks/sprint_summaries.py \
+        [--teams 50] [--sprints 100]
+"""
+import argparse
+from datetime import datetime, timedelta
+import random
+import timeit
+
+import pandas as pd
+
+from reports.utils import (
+    goal_complete, mk_issues_summary_df, mk_sprint_summaries_df)
+
+
+def mk_team_sprints(teams, sprints, issues_per_sprint, seed=0):
+    rng = random.Random(seed)
+    team_sprints = []
+    for team in range(teams):
+        for sprint in range(sprints):
+            start = datetime(2020, 1, 1) + timedelta(weeks=2 * sprint)
+            team_sprints.append((f'team-{team}', {
+                '_id': team * sprints + sprint,
+                'start': start,
+                'end': start + timedelta(weeks=2),
+                'auxillary_data': [{'goal_completed': rng.random() > 0.5}],
+                'issues': [
+                    {
+                        'planned': rng.random() > 0.3,
+                        'finished_in_sprint': rng.random() > 0.2,
+                        'bau': rng.random() > 0.7
+                    }
+                    for _ in range(rng.randint(1, 2 * issues_per_sprint))
+                ]
+            }))
+    return team_sprints
+
+
+def per_sprint(team_sprints):
+    summaries = []
+    for team_name, sprint_data in team_sprints:
+        aux = sprint_data['auxillary_data']
+        df = mk_issues_summary_df(sprint_data).tail(1)
+        df['start_date'] = sprint_data['start']
+        df['end_date'] = sprint_data['end']
+        df['goal_completed'] = 100 if goal_complete(aux[-1]) else 0
+        df['_id'] = sprint_data['_id']
+        df['team_name'] = team_name
+        summaries.append(df.drop(columns=['planned']))
+    return pd.concat(summaries).reset_index(drop=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--teams', type=int, default=50)
+    parser.add_argument('--sprints', type=int, default=100)
+    parser.add_argument('--issues', type=int, default=15)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    team_sprints = mk_team_sprints(args.teams, args.sprints, args.issues)
+    print(
+        f'{args.teams} teams x {args.sprints} sprints, '
+        f'{sum(len(s["issues"]) for _, s in team_sprints)} issues')
+
+    pd.testing.assert_frame_equal(
+        per_sprint(team_sprints),
+        mk_sprint_summaries_df(team_sprints).drop(
+            columns=['sprint_version']),
+        check_dtype=False)
+
+    for name, fn in [
+            ('per sprint', per_sprint),
+            ('vectorised', mk_sprint_summaries_df)]:
+        best = min(timeit.repeat(
+            lambda: fn(team_sprints), number=1, repeat=args.repeat))
+        print(f'{name:>12}: {best:.3f}s')
+
+
+if __name__ == '__main__':
+    pd.options.mode.chained_assignment = None
+    main()
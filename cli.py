@@ -7,8 +7,10 @@ import sys
 from backends.jira import fetch_all_completed_issues, fetch_sprints
 from config import config, json_provider, parse_teams_input
 from database.mongo import get_client
-from reports.sprint_performance import create_reports as create_performance_reports
-from reports.bau_summary import create_reports as create_bau_reports
+from models.metrics_figures import TeamMetricsFigures
+from reports.combined import create_reports
+from reports.cycle_time import mk_cycle_time_stats
+from reports.utils import METRICS_NUM_SPRINTS, window_start
 
 
 logging.basicConfig(
@@ -21,6 +23,18 @@ log = logging.getLogger(__name__)
 log.setLevel('INFO')
 
 
+def refresh_metrics(db_client):
+    ''' Bring the Metrics page up to date with new reports, its BAU
+        totals and its figures, so that the dashboard has nothing to
+        draw on the next visit.
+    '''
+    team_names = [team.name for team in config.get('teams').teams]
+    db_client.refresh_bau_totals(
+        team_names, window_start(METRICS_NUM_SPRINTS))
+    for team_name in team_names:
+        TeamMetricsFigures(team_name).figures()
+
+
 @click.group()
 def cli():
     pass
@@ -83,9 +97,14 @@ def issues(
     for team in config.get('teams').teams:
         log.info(f'Extracting Issue history for {team}')
         data = fetch_all_completed_issues(team.board_id)
-        db_client.add_historic_issues(
+        issues = list(chain(*[d.to_mongo() for d in data]))
+        db_client.add_historic_issues(team.name, issues)
+        # From all of the team's stored issues, like the days taken
+        # sketch, not just those fetched this time.
+        db_client.update_cycle_time_stats(
             team.name,
-            list(chain(*[d.to_mongo() for d in data])))
+            mk_cycle_time_stats(
+                db_client.get_historic_days_taken(team.name)))
 
 
 @extract.group()
@@ -110,29 +129,39 @@ def sprints():
     help=(
         '(team name, board id), '
         'alternatively provide these in --config file'))
+@click.option(
+    '--issue-layout', envvar='DB_ISSUE_LAYOUT',
+    type=click.Choice(['embedded', 'normalised']), default='embedded',
+    help=(
+        'Store sprint issues embedded in the sprint documents, '
+        'or normalised in the sprint_issues collection.'))
 @click_config_file.configuration_option(
     provider=json_provider, implicit=False)
 def latest(
-        team,
+        team, issue_layout,
         jira_url, jira_user_email, access_token,
         db_host, db_port, db_username, db_password):
     check_jira_config(team, jira_url, jira_user_email)
     config.set('jira', jira_url, jira_user_email, access_token)
     config.set('teams', parse_teams_input(team))
-    config.set('db', db_host, db_port, db_username, db_password)
+    config.set(
+        'db', db_host, db_port, db_username, db_password,
+        issue_layout=issue_layout)
     db_client = get_client()
 
+    team_sprints = {}
     for team in config.get('teams').teams:
         log.info(f'Extracting sprint data for {team}')
-        data = fetch_sprints(team.board_id)
-        for sprint_data in data:
-            db_client.add_sprint(team.name, sprint_data)
+        team_sprints[team.name] = fetch_sprints(team.board_id)
+    db_client.add_sprints(team_sprints)
 
     log.info('Updating all sprint reports')
-    reports = create_performance_reports(config.get('teams').teams)
-    db_client.update_performance_reports(reports.to_dict(orient='records'))
-    reports = create_bau_reports(config.get('teams').teams)
-    db_client.update_bau_reports(reports.to_dict(orient='records'))
+    performance_reports, bau_reports = create_reports(
+        config.get('teams').teams)
+    db_client.update_reports(
+        performance_reports.to_dict(orient='records'),
+        bau_reports.to_dict(orient='records'))
+    refresh_metrics(db_client)
 
 
 @cli.group()
@@ -154,22 +183,50 @@ def generate():
     '--num-sprints', type=int, default=3,
     help='Number of past sprints to generate reports for.'
 )
+@click.option(
+    '--force', is_flag=True,
+    help=(
+        'Regenerate every report, not just those whose sprint '
+        'has changed since they were generated.'))
 @click_config_file.configuration_option(
     provider=json_provider, implicit=False)
 def sprint_reports(
-        team, num_sprints,
+        team, num_sprints, force,
         db_host, db_port, db_username, db_password):
     config.set('teams', parse_teams_input(team))
     config.set('db', db_host, db_port, db_username, db_password)
     db_client = get_client()
 
     log.info('Updating all sprint reports')
-    reports = create_performance_reports(
-        config.get('teams').teams, num_sprints=num_sprints)
-    db_client.update_performance_reports(reports.to_dict(orient='records'))
-    reports = create_bau_reports(
-        config.get('teams').teams, num_sprints=num_sprints)
-    db_client.update_bau_reports(reports.to_dict(orient='records'))
+    performance_reports, bau_reports = create_reports(
+        config.get('teams').teams, num_sprints=num_sprints, force=force)
+    db_client.update_reports(
+        performance_reports.to_dict(orient='records'),
+        bau_reports.to_dict(orient='records'))
+    refresh_metrics(db_client)
+
+
+@cli.group()
+def db():
+    pass
+
+
+@db.command()
+@click.argument('db-host', envvar='DB_HOST', default='localhost')
+@click.argument('db-port', envvar='DB_PORT', type=int, default=27017)
+@click.argument('db-username', envvar='DB_USERNAME', default='root')
+@click.argument('db-password', envvar='DB_PASSWORD', default='rootpassword')
+def normalise_issues(db_host, db_port, db_username, db_password):
+    ''' Move existing sprint issues in to the sprint_issues collection,
+        to go with DB_ISSUE_LAYOUT=normalised.
+    '''
+    config.set(
+        'db', db_host, db_port, db_username, db_password,
+        issue_layout='normalised')
+    _, failed = get_client().normalise_sprint_issues()
+    if failed:
+        raise click.ClickException(
+            f'{failed} sprints kept their issues, run again to retry')
 
 
 if __name__ == '__main__':
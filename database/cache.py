@@ -0,0 +1,131 @@
+from collections import OrderedDict
+from copy import deepcopy
+from functools import wraps
+from inspect import signature
+from threading import RLock
+import time
+
+
+class TTLCache:
+    ''' A bounded LRU cache whose entries expire after `ttl` seconds.
+
+        Each entry can be registered against a set of tags, e.g.
+        ('sprint', 1234), so that writes can invalidate exactly the
+        entries derived from the data they touched rather than flushing
+        the whole cache.
+    '''
+    def __init__(self, ttl, max_size, clock=time.monotonic):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._tags = {}
+        self._lock = RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self):
+        return self.ttl > 0 and self.max_size > 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            expires, _, value = entry
+            if expires <= self.clock():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, tags=()):
+        if not self.enabled:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            tags = frozenset(tags)
+            self._entries[key] = (self.clock() + self.ttl, tags, value)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_size:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate(self, *tags):
+        with self._lock:
+            for tag in tags:
+                for key in list(self._tags.get(tag, ())):
+                    self._remove(key)
+                    self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+
+    def _remove(self, key):
+        _, tags, _ = self._entries.pop(key)
+        for tag in tags:
+            keys = self._tags[tag]
+            keys.discard(key)
+            if not keys:
+                del self._tags[tag]
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations
+            }
+
+
+_MISSING = object()
+
+
+def cached(tagger):
+    ''' Read-through caching for `Client` query methods.
+
+        `tagger` is called with the method arguments followed by the
+        query result and returns the tags the result depends on.
+        Results are deep-copied on the way in and out, as callers
+        routinely mutate the documents they are handed.
+    '''
+    def decorator(method):
+        sig = signature(method)
+
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            # normalise keyword arguments so get(x) and get(arg=x)
+            # share an entry
+            bound = sig.bind(self, *args, **kwargs)
+            bound.apply_defaults()
+            args = bound.args[1:]
+            key = (method.__name__,) + args
+            value = self.cache.get(key, _MISSING)
+            if value is _MISSING:
+                value = method(self, *args)
+                self.cache.set(
+                    key, deepcopy(value), tagger(*args, value))
+                return value
+            return deepcopy(value)
+        return wrapper
+    return decorator
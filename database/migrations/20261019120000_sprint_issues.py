@@ -0,0 +1,37 @@
+"""
+Add the sprint_issues collection, issues kept out of the sprint
+documents, keyed by (sprint_id, issue name), so that sprint documents
+stay small for list queries.
+
+Only the indexes are created here. New sprints are written in this
+layout with issue_layout set to 'normalised' (DB_ISSUE_LAYOUT), and the
+issues of existing sprints are moved across with
+`python cli.py db normalise-issues`. Reads work against either layout.
+"""
+
+from pymongo import ASCENDING
+
+name = "20261019120000_sprint_issues"
+dependencies = ["20201030143800_add_datascience"]
+
+
+def upgrade(db):
+    db.sprint_issues.create_index(
+        [("team_id", ASCENDING), ("sprint_id", ASCENDING)])
+    db.sprint_issues.create_index(
+        [("sprint_id", ASCENDING), ("position", ASCENDING)])
+
+
+def downgrade(db):
+    for sprint in db.sprints.find({"issues": {"$exists": False}}):
+        issues = [
+            {
+                k: v for k, v in issue.items()
+                if k not in ("_id", "sprint_id", "team_id", "position")
+            }
+            for issue in db.sprint_issues.find(
+                {"sprint_id": sprint["_id"]}).sort("position", ASCENDING)
+        ]
+        db.sprints.update_one(
+            {"_id": sprint["_id"]}, {"$set": {"issues": issues}})
+    db.sprint_issues.drop()
@@ -0,0 +1,78 @@
+"""
+Store BAU report summaries as label to issue count maps rather than a
+flat list with an entry per BAU issue label, and total each team's
+counts over the sprints shown on the Metrics page.
+"""
+
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+from pymongo import ReplaceOne
+
+name = "20261019130000_bau_label_counts"
+dependencies = ["20261019120000_sprint_issues"]
+
+
+def upgrade(db):
+    for report in db.bau_reports.find({"bau_summary": {"$type": "array"}}):
+        db.bau_reports.update_one(
+            {"_id": report["_id"]},
+            {"$set": {
+                "bau_summary": dict(
+                    Counter(report["bau_summary"]).most_common())
+            }})
+
+    # The Metrics page's window, reports.utils.window_start(6)
+    ending_after = (
+        datetime.now(timezone.utc) - timedelta(weeks=6 * 2)).replace(
+            hour=0, minute=0, second=0, microsecond=0)
+    totals = {
+        team_name: {} for team_name in db.bau_reports.distinct("team_name")}
+    for team in db.bau_reports.aggregate([
+            {"$match": {"end_date": {"$gte": ending_after}}},
+            {"$project": {
+                "team_name": 1,
+                "labels": {"$objectToArray": "$bau_summary"}
+            }},
+            {"$unwind": "$labels"},
+            {"$group": {
+                "_id": {"team_name": "$team_name", "label": "$labels.k"},
+                "count": {"$sum": "$labels.v"}
+            }},
+            {"$sort": {"count": -1}},
+            {"$group": {
+                "_id": "$_id.team_name",
+                "labels": {"$push": {"k": "$_id.label", "v": "$count"}}
+            }},
+            {"$project": {"bau_summary": {"$arrayToObject": "$labels"}}}]):
+        totals[team["_id"]] = team["bau_summary"]
+    if totals:
+        db.bau_totals.bulk_write([
+            ReplaceOne(
+                {"_id": team_name},
+                {
+                    "_id": team_name,
+                    "team_name": team_name,
+                    "ending_after": ending_after,
+                    "bau_summary": bau_summary
+                },
+                upsert=True)
+            for team_name, bau_summary in totals.items()
+        ])
+        # Retire the Metrics figures drawn without these totals
+        db.meta.update_one(
+            {"_id": "reports"}, {"$inc": {"version": 1}}, upsert=True)
+
+
+def downgrade(db):
+    for report in db.bau_reports.find({"bau_summary": {"$type": "object"}}):
+        db.bau_reports.update_one(
+            {"_id": report["_id"]},
+            {"$set": {
+                "bau_summary": [
+                    label
+                    for label, count in report["bau_summary"].items()
+                    for _ in range(count)
+                ]
+            }})
+    db.bau_totals.drop()
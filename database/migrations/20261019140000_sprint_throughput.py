@@ -0,0 +1,23 @@
+"""
+Record on each sprint the number of issues finished in it, so that
+forecasts don't have to load every issue to count them.
+"""
+
+name = "20261019140000_sprint_throughput"
+dependencies = ["20261019130000_bau_label_counts"]
+
+
+def upgrade(db):
+    for sprint in db.sprints.find({"throughput": {"$exists": False}}):
+        if "issues" in sprint:
+            throughput = len(
+                [i for i in sprint["issues"] if i["finished_in_sprint"]])
+        else:
+            throughput = db.sprint_issues.count_documents(
+                {"sprint_id": sprint["_id"], "finished_in_sprint": True})
+        db.sprints.update_one(
+            {"_id": sprint["_id"]}, {"$set": {"throughput": throughput}})
+
+
+def downgrade(db):
+    db.sprints.update_many({}, {"$unset": {"throughput": ""}})
@@ -0,0 +1,19 @@
+"""
+Index historic issues by team, for the per team queries: a team's
+issues, for plotting, and its days taken, for the cycle time stats.
+"""
+
+from pymongo import ASCENDING
+
+name = "20261019150000_historic_issues_team_index"
+dependencies = ["20261019140000_sprint_throughput"]
+
+
+def upgrade(db):
+    db.historic_issues.create_index(
+        [("team_id", ASCENDING), ("end_time", ASCENDING)])
+
+
+def downgrade(db):
+    db.historic_issues.drop_index(
+        [("team_id", ASCENDING), ("end_time", ASCENDING)])
@@ -0,0 +1,30 @@
+"""
+Build each team's days taken sketch, the count of its historic issues
+taking each number of days, from the historic issues extracted so far.
+"""
+
+name = "20261019160000_days_taken_sketches"
+dependencies = ["20261019150000_historic_issues_team_index"]
+
+
+def upgrade(db):
+    team_names = {team["_id"]: team["name"] for team in db.teams.find()}
+    sketches = {}
+    for row in db.historic_issues.aggregate([
+            {"$match": {"days_taken": {"$ne": None}}},
+            {"$group": {
+                "_id": {"team_id": "$team_id", "days": "$days_taken"},
+                "count": {"$sum": 1}
+            }}]):
+        counts = sketches.setdefault(row["_id"]["team_id"], {})
+        counts[str(row["_id"]["days"])] = row["count"]
+    for team_id, counts in sketches.items():
+        db.days_taken_sketches.replace_one(
+            {"_id": team_id},
+            {"team_name": team_names.get(team_id), "counts": counts},
+            upsert=True)
+    db.days_taken_sketches.create_index("team_name")
+
+
+def downgrade(db):
+    db.days_taken_sketches.drop()
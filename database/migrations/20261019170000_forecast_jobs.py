@@ -0,0 +1,14 @@
+"""
+Expire forecast jobs a day after they were started.
+"""
+
+name = "20261019170000_forecast_jobs"
+dependencies = ["20261019160000_days_taken_sketches"]
+
+
+def upgrade(db):
+    db.forecast_jobs.create_index("created", expireAfterSeconds=86400)
+
+
+def downgrade(db):
+    db.forecast_jobs.drop()
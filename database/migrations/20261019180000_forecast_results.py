@@ -0,0 +1,14 @@
+"""
+Expire persisted forecast results a week after they were computed.
+"""
+
+name = "20261019180000_forecast_results"
+dependencies = ["20261019170000_forecast_jobs"]
+
+
+def upgrade(db):
+    db.forecast_results.create_index("created", expireAfterSeconds=604800)
+
+
+def downgrade(db):
+    db.forecast_results.drop()
@@ -0,0 +1,20 @@
+"""
+Index performance reports by team, for the per team Metrics panels, and
+drop the figures previously drawn for the whole Metrics page.
+"""
+
+from pymongo import ASCENDING
+
+name = "20261019190000_performance_reports_team_index"
+dependencies = ["20261019180000_forecast_results"]
+
+
+def upgrade(db):
+    db.performance_reports.create_index(
+        [("team_name", ASCENDING), ("end_date", ASCENDING)])
+    db.metrics_figures.delete_one({"_id": "metrics"})
+
+
+def downgrade(db):
+    db.performance_reports.drop_index(
+        [("team_name", ASCENDING), ("end_date", ASCENDING)])
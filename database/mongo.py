@@ -1,9 +1,16 @@
+from collections import Counter
 from dataclasses import dataclass
-from pymongo import MongoClient, ReplaceOne
-from pymongo.errors import DuplicateKeyError
+import os
+from datetime import datetime
+from pymongo import MongoClient, ReplaceOne, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+from pymongo.read_preferences import (
+    Nearest, Primary, PrimaryPreferred, Secondary, SecondaryPreferred)
 import logging
+from typing import Optional
 
 from config import config, configclass
+from .cache import TTLCache, cached
 
 
 log = logging.getLogger(__name__)
@@ -17,19 +24,152 @@ class DBConfig:
     port: int
     username: str
     password: str
+    # Read-through cache in front of the query methods, a ttl or size
+    # of 0 disables it.
+    cache_ttl: int = 300
+    cache_size: int = 256
+    max_pool_size: int = 100
+    min_pool_size: int = 0
+    wait_queue_timeout_ms: Optional[int] = None
+    server_selection_timeout_ms: int = 30000
+    # Routing for the read-only dashboard queries, writes always go to
+    # the primary. -1 means no maximum staleness.
+    read_preference: str = 'primary'
+    max_staleness_seconds: int = -1
+    # Where new sprints store their issues, embedded in the sprint
+    # document or 'normalised' in to the sprint_issues collection.
+    # Reads handle either layout.
+    issue_layout: str = 'embedded'
+    # Share forecast results between processes, and across restarts,
+    # by keeping them in mongo as well as in memory.
+    persist_forecasts: bool = False
 
 
 config.register('db', DBConfig)
 
 
+ISSUE_LAYOUTS = ('embedded', 'normalised')
+
+# sprint_issues fields which place an issue rather than describe it.
+SPRINT_ISSUE_KEYS = ('_id', 'sprint_id', 'team_id', 'position')
+
+
+def mk_sprint_issue_docs(sprint):
+    return [
+        dict(
+            issue,
+            _id={'sprint_id': sprint['_id'], 'name': issue['name']},
+            sprint_id=sprint['_id'],
+            team_id=sprint['team_id'],
+            position=position)
+        for position, issue in enumerate(sprint['issues'])
+    ]
+
+
+def strip_sprint_issue_doc(doc):
+    return {k: v for k, v in doc.items() if k not in SPRINT_ISSUE_KEYS}
+
+
+# Aggregation stages that give normalised sprints back their issues
+# list, leaving embedded ones as they are.
+SPRINT_ISSUES_LOOKUP = [
+    {
+        "$lookup": {
+            "from": "sprint_issues",
+            "let": {"sprint_id": "$_id"},
+            "pipeline": [
+                {"$match": {"$expr": {"$eq": ["$sprint_id", "$$sprint_id"]}}},
+                {"$sort": {"position": 1}},
+                {"$project": {key: 0 for key in SPRINT_ISSUE_KEYS}}
+            ],
+            "as": "sprint_issues"
+        }
+    },
+    {
+        "$addFields": {"issues": {"$ifNull": ["$issues", "$sprint_issues"]}}
+    },
+    {
+        "$project": {"sprint_issues": 0}
+    }
+]
+
+
+READ_PREFERENCES = {
+    'primary': Primary,
+    'primaryPreferred': PrimaryPreferred,
+    'secondary': Secondary,
+    'secondaryPreferred': SecondaryPreferred,
+    'nearest': Nearest
+}
+
+
+def mk_read_preference(mode, max_staleness):
+    try:
+        read_preference = READ_PREFERENCES[mode]
+    except KeyError:
+        raise ValueError(
+            f'unknown read preference {mode}, '
+            f'choose one of {", ".join(READ_PREFERENCES)}')
+    if read_preference is Primary:
+        return Primary()
+    return read_preference(max_staleness=max_staleness)
+
+
 class Client:
     def __init__(self):
-        conn_info = config.get('db')
-        self.client = MongoClient(
-            host=conn_info.host,
-            port=conn_info.port,
-            username=conn_info.username,
-            password=conn_info.password)
+        self.conn_info = config.get('db')
+        self.cache = TTLCache(
+            self.conn_info.cache_ttl, self.conn_info.cache_size)
+        self.read_preference = mk_read_preference(
+            self.conn_info.read_preference,
+            self.conn_info.max_staleness_seconds)
+        if self.conn_info.issue_layout not in ISSUE_LAYOUTS:
+            raise ValueError(
+                f'unknown issue layout {self.conn_info.issue_layout}, '
+                f'choose one of {", ".join(ISSUE_LAYOUTS)}')
+        self._client = None
+        self._pid = None
+
+    @property
+    def client(self):
+        # MongoClient is not fork-safe, its connection pool and monitor
+        # threads don't survive a fork. So connect lazily, and again in
+        # any process forked after we connected (e.g. gunicorn workers).
+        if self._client is None or self._pid != os.getpid():
+            conn_info = self.conn_info
+            self._client = MongoClient(
+                host=conn_info.host,
+                port=conn_info.port,
+                username=conn_info.username,
+                password=conn_info.password,
+                maxPoolSize=conn_info.max_pool_size,
+                minPoolSize=conn_info.min_pool_size,
+                waitQueueTimeoutMS=conn_info.wait_queue_timeout_ms,
+                serverSelectionTimeoutMS=(
+                    conn_info.server_selection_timeout_ms))
+            self._pid = os.getpid()
+        return self._client
+
+    @property
+    def read_db(self):
+        ''' The sprints database for read-only queries, routed with the
+            configured read preference so that dashboard traffic can be
+            served by secondaries while the ETL writes to the primary.
+        '''
+        return self.client.get_database(
+            'sprints', read_preference=self.read_preference)
+
+    def warm_up(self):
+        ''' Establish the connection pool up front, so the first request
+            served doesn't pay for server selection and the handshake.
+            Doubles as a health check.
+        '''
+        try:
+            self.client.admin.command('ping')
+        except PyMongoError as e:
+            log.error('Database warm up failed: %s' % e)
+            return False
+        return True
 
     def add_historic_issues(self, team_name, issues):
         db = self.client.sprints
@@ -44,6 +184,23 @@ class Client:
         for issue in issues:
             issue['team_id'] = team_id
 
+        # Issues being replaced are taken back out of the days taken
+        # sketch before their new values go in. Without a sketch to take
+        # them out of, it is built from all the stored issues instead.
+        has_sketch = db.days_taken_sketches.find_one(
+            {'_id': team_id}, projection={'_id': 1}) is not None
+        sketch_delta = Counter(
+            issue['days_taken'] for issue in issues
+            if issue['days_taken'] is not None)
+        sketch_delta.subtract(
+            issue['days_taken']
+            for issue in db.historic_issues.find(
+                {
+                    'name': {'$in': [issue['name'] for issue in issues]},
+                    'days_taken': {'$ne': None}
+                },
+                projection={'days_taken': 1}))
+
         # As time goes on issues move in to Done, thus becoming "historic"
         # We do a replace-upsert to both capture new historic issues and
         # update the old issues if any changes have been made.
@@ -56,34 +213,316 @@ class Client:
         if res.bulk_api_result['writeErrors']:
             log.error(res.bulk_api_result['writeErrors'])
 
+        increments = {
+            f'counts.{days}': count
+            for days, count in sketch_delta.items() if count}
+        if not has_sketch:
+            db.days_taken_sketches.replace_one(
+                {'_id': team_id},
+                {
+                    'team_name': team_name,
+                    'counts': {
+                        str(days): count
+                        for days, count in Counter(
+                            self.get_historic_days_taken(team_name)).items()
+                    }
+                },
+                upsert=True)
+        elif increments:
+            db.days_taken_sketches.update_one(
+                {'_id': team_id},
+                {'$set': {'team_name': team_name}, '$inc': increments},
+                upsert=True)
+
+        self.cache.invalidate(
+            ('historic_issues', team_name), ('days_taken_sketch', team_name))
         log.info(
             'Replaced historic issues for %s' % team_name)
 
+    @cached(lambda team_name, res: [('historic_issues', team_name)])
     def get_historic_issues(self, team_name):
-        db = self.client.sprints
+        db = self.read_db
         team_id = db.teams.find_one({'name': team_name})['_id']
         return list(db.historic_issues.find({"team_id": team_id}))
 
+    def get_historic_days_taken(self, team_name):
+        ''' The days taken by each of a team's stored historic issues,
+            uncached and from the primary, to build stats from what was
+            just written.
+        '''
+        db = self.client.sprints
+        team_id = db.teams.find_one({'name': team_name})['_id']
+        return [
+            issue['days_taken'] for issue in db.historic_issues.find(
+                {'team_id': team_id, 'days_taken': {'$ne': None}},
+                projection={'_id': 0, 'days_taken': 1})]
+
+    def update_cycle_time_stats(self, team_name, stats):
+        db = self.client.sprints
+        team_id = db.teams.find_one({'name': team_name})['_id']
+        db.cycle_time_stats.update_one(
+            {'_id': team_id},
+            {
+                '$set': dict(stats, team_name=team_name),
+                '$inc': {'version': 1}
+            },
+            upsert=True)
+        self.cache.invalidate(('cycle_time_stats', team_name))
+        log.info('Updated cycle time stats for %s' % team_name)
+
+    @cached(lambda team_name, res: [('cycle_time_stats', team_name)])
+    def get_cycle_time_stats(self, team_name):
+        db = self.read_db
+        team_id = db.teams.find_one({'name': team_name})['_id']
+        return db.cycle_time_stats.find_one({'_id': team_id})
+
+    @cached(lambda team_names, res: [
+        ('days_taken_sketch', team_name) for team_name in team_names])
+    def get_days_taken_sketches(self, team_names):
+        ''' Per team counts of historic issues by days taken, as
+            {'team_name': ..., 'counts': {days: count}}
+        '''
+        db = self.read_db
+        return list(db.days_taken_sketches.find(
+            {'team_name': {'$in': list(team_names)}},
+            projection={'_id': 0}))
+
+    def start_forecast_job(self, job_id, job):
+        ''' Records a new job, unless there already is one with the
+            same id, in which case that job is returned instead.
+        '''
+        db = self.client.sprints
+        now = datetime.utcnow()
+        return db.forecast_jobs.find_one_and_update(
+            {'_id': job_id},
+            {'$setOnInsert': dict(job, created=now, updated=now)},
+            upsert=True,
+            return_document=ReturnDocument.BEFORE)
+
+    def restart_forecast_job(self, job_id, last_updated, job):
+        ''' Takes over a failed or abandoned job, as long as no one
+            else has touched it since `last_updated`.
+        '''
+        db = self.client.sprints
+        res = db.forecast_jobs.update_one(
+            {'_id': job_id, 'updated': last_updated},
+            {'$set': dict(job, updated=datetime.utcnow())})
+        return res.modified_count == 1
+
+    def update_forecast_job(self, job_id, **fields):
+        db = self.client.sprints
+        db.forecast_jobs.update_one(
+            {'_id': job_id},
+            {'$set': dict(fields, updated=datetime.utcnow())})
+
+    def get_forecast_job(self, job_id):
+        # Not cached, as it is polled for progress
+        db = self.client.sprints
+        return db.forecast_jobs.find_one({'_id': job_id})
+
+    def get_forecast_result(self, result_id):
+        db = self.read_db
+        doc = db.forecast_results.find_one({'_id': result_id})
+        return doc['result'] if doc else None
+
+    def put_forecast_result(self, result_id, result):
+        db = self.client.sprints
+        db.forecast_results.replace_one(
+            {'_id': result_id},
+            {'result': result, 'created': datetime.utcnow()},
+            upsert=True)
+
+    def get_forecast_data_version(self, team_name, ending_after):
+        ''' A cheap fingerprint of the data a team's forecast is built
+            from: the version of its cycle time stats, and the versions
+            of its sprints ending after `ending_after`.
+            Deliberately uncached, it is what detects stale data.
+        '''
+        db = self.read_db
+        team_id = db.teams.find_one({'name': team_name})['_id']
+        stats = db.cycle_time_stats.find_one(
+            {'_id': team_id}, projection={'version': 1}) or {}
+        sprints = db.sprints.find(
+            {
+                'team_id': team_id,
+                'end': {'$gte': ending_after}
+            },
+            projection={'version': 1}).sort([('start', -1)])
+        return (
+            stats.get('version', 0),
+            tuple((sprint['_id'], sprint.get('version', 0))
+                  for sprint in sprints))
+
+    @cached(lambda sprint_id, res: [('sprint', sprint_id)])
     def get_sprint(self, sprint_id):
         db = self.client.sprints
-        return db.sprints.find_one({'_id': sprint_id})
+        sprint = db.sprints.find_one({'_id': sprint_id})
+        if sprint is None:
+            return None
+        return self._with_issues(db, [sprint]).pop()
+
+    def _with_issues(self, db, sprints):
+        ''' Fill in the issues of normalised sprints, in one query. '''
+        normalised = [
+            sprint['_id'] for sprint in sprints if 'issues' not in sprint]
+        if not normalised:
+            return sprints
+
+        issues = {sprint_id: [] for sprint_id in normalised}
+        for doc in db.sprint_issues.find(
+                {'sprint_id': {'$in': normalised}}).sort([('position', 1)]):
+            issues[doc['sprint_id']].append(strip_sprint_issue_doc(doc))
+        for sprint in sprints:
+            if 'issues' not in sprint:
+                sprint['issues'] = issues[sprint['_id']]
+        return sprints
+
+    def get_sprint_issues_page(self, sprint_id, match, sort, skip, limit):
+        ''' One page of a sprint's issues, those matching the `match`
+            query in `sort` order (field, direction) pairs, along with
+            the number of matching issues. Works with either issue layout.
+        '''
+        db = self.read_db
+        res = next(db.sprints.aggregate(self._sprint_issues_page_pipeline(
+            sprint_id, match, sort, skip, limit)), None)
+        if res is None:
+            return [], 0
+        total = res['total'][0]['count'] if res['total'] else 0
+        return res['issues'], total
 
     def add_sprint(self, team_name, data):
-        db = self.client.sprints
-        team = db.teams.find_one({'name': team_name})
+        return self.add_sprints({team_name: [data]})[data['_id']]
 
-        if team is None:
-            team_id = self.add_team(team_name)
-            log.info('Added new team %s' % team_name)
-        else:
-            team_id = team['_id']
+    def add_sprints(self, team_sprints):
+        ''' Bulk ingest of sprints, for any number of teams.
 
-        data['team_id'] = team_id
+            `team_sprints` maps team names to lists of sprint documents.
+            Sprints that have already been extracted are left untouched.
+            Returns a mapping of sprint id to one of 'created', 'skipped'
+            or 'failed'.
+        '''
+        db = self.client.sprints
+        team_ids = self.resolve_team_ids(team_sprints.keys())
+        normalised = self.conn_info.issue_layout == 'normalised'
+        excluded = ('_id', 'issues') if normalised else ('_id',)
+
+        sprints_by_id = {}
+        for team_name, sprints in team_sprints.items():
+            for data in sprints:
+                data['team_id'] = team_ids[team_name]
+                sprints_by_id[data['_id']] = data
+        if not sprints_by_id:
+            return {}
+
+        status = {sprint_id: 'skipped' for sprint_id in sprints_by_id}
+        if normalised:
+            # Issues are written before their sprint, so that a sprint
+            # only exists with all of its issues, and one whose issues
+            # failed is extracted again by the next run.
+            existing = {
+                sprint['_id'] for sprint in db.sprints.find(
+                    {'_id': {'$in': list(sprints_by_id)}},
+                    projection={'_id': 1})}
+            for sprint_id in self._add_sprint_issues(db, [
+                    sprint for sprint_id, sprint in sprints_by_id.items()
+                    if sprint_id not in existing]):
+                status[sprint_id] = 'failed'
+
+        sprint_ids = [
+            sprint_id for sprint_id in sprints_by_id
+            if status[sprint_id] != 'failed']
+        upserts = [
+            UpdateOne(
+                {'_id': sprint_id},
+                {'$setOnInsert': dict(
+                    {
+                        k: v for k, v in sprints_by_id[sprint_id].items()
+                        if k not in excluded
+                    },
+                    version=1)},
+                upsert=True)
+            for sprint_id in sprint_ids]
+        created = []
+        if upserts:
+            try:
+                res = db.sprints.bulk_write(upserts, ordered=False)
+                created = res.upserted_ids.values()
+            except BulkWriteError as e:
+                log.error(e.details['writeErrors'])
+                created = [upsert['_id'] for upsert in e.details['upserted']]
+                for error in e.details['writeErrors']:
+                    status[sprint_ids[error['index']]] = 'failed'
+        for sprint_id in created:
+            status[sprint_id] = 'created'
+
+        self.cache.invalidate(
+            *[('sprints', team_name) for team_name in team_sprints],
+            *[('sprint', sprint_id) for sprint_id in status])
+        log.info(
+            'Added %d sprints, %d already extracted' % (
+                list(status.values()).count('created'),
+                list(status.values()).count('skipped')))
+        return status
+
+    def _add_sprint_issues(self, db, sprints):
+        ''' Write the issues of sprints in the normalised layout,
+            returning the ids of the sprints whose issues were not all
+            written.
+        '''
+        docs = [
+            doc for sprint in sprints
+            for doc in mk_sprint_issue_docs(sprint)]
+        if not docs:
+            return set()
         try:
-            db.sprints.insert_one(data)
-        except DuplicateKeyError as e:
-            assert e.details['keyValue']['_id'] == data['_id']
-            log.info('Sprint with id %s already extracted' % data['_id'])
+            db.sprint_issues.bulk_write([
+                ReplaceOne({'_id': doc['_id']}, doc, upsert=True)
+                for doc in docs
+            ], ordered=False)
+        except BulkWriteError as e:
+            log.error(e.details['writeErrors'])
+            return {
+                docs[error['index']]['sprint_id']
+                for error in e.details['writeErrors']}
+        return set()
+
+    def normalise_sprint_issues(self):
+        ''' Move the issues of sprints stored in the embedded layout in
+            to the sprint_issues collection. A sprint keeps its issues
+            until they have all been written, so a failed or interrupted
+            run can simply be repeated.
+        '''
+        db = self.client.sprints
+        moved = failed = 0
+        for sprint in db.sprints.find(
+                {'issues': {'$exists': True}},
+                projection={'issues': 1, 'team_id': 1}):
+            if self._add_sprint_issues(db, [sprint]):
+                failed += 1
+                continue
+            db.sprints.update_one(
+                {'_id': sprint['_id']}, {'$unset': {'issues': ''}})
+            moved += 1
+        log.info(
+            'Moved the issues of %d sprints, %d failed' % (moved, failed))
+        return moved, failed
+
+    def resolve_team_ids(self, team_names):
+        ''' Look up the ids of all the named teams in one query,
+            adding any teams we haven't seen before.
+        '''
+        db = self.client.sprints
+        team_names = list(dict.fromkeys(team_names))
+        team_ids = {
+            team['name']: team['_id']
+            for team in db.teams.find({'name': {'$in': team_names}})
+        }
+        missing = [name for name in team_names if name not in team_ids]
+        if missing:
+            res = db.teams.insert_many([{'name': name} for name in missing])
+            team_ids.update(zip(missing, res.inserted_ids))
+            log.info('Added new teams %s' % ', '.join(missing))
+        return team_ids
 
     def add_team(self, team_name):
         db = self.client.sprints
@@ -91,35 +530,59 @@ class Client:
         return res.inserted_id
 
     def get_sprint_auxillary_data(self, sprint_id):
+        ''' Uncached and from the primary, it is what saves are checked
+            against, and other processes may have saved since.
+        '''
         db = self.client.sprints
         return db.sprints_aux.find_one({'sprint_id': sprint_id}) or {}
 
     def update_sprint_auxillary_data(self, sprint_id, data):
+        ''' Sets just the fields in `data`, leaving any others as
+            another process may have saved them.
+        '''
         db = self.client.sprints
-        data['sprint_id'] = sprint_id
-        db.sprints_aux.replace_one(
+        db.sprints_aux.update_one(
             {'sprint_id': sprint_id},
-            data,
+            {'$set': data},
             upsert=True)
+        # Auxillary data feeds the reports, so the sprint's content
+        # version is bumped for report generation to pick it up.
+        db.sprints.update_one({'_id': sprint_id}, {'$inc': {'version': 1}})
+        self.cache.invalidate(('sprint_aux', sprint_id), ('sprint', sprint_id))
 
+    @cached(lambda team_name, res: [('sprints', team_name)])
     def get_latest_sprint(self, team_name):
         db = self.client.sprints
         team_id = db.teams.find_one({'name': team_name})['_id']
-        return list(db.sprints.find(
-            {'team_id': team_id}).sort([('start', -1)]).limit(1)).pop()
-
-    def get_sprints(self, team_name, ending_after):
-        db = self.client.sprints
+        return self._with_issues(db, list(db.sprints.find(
+            {'team_id': team_id}).sort([('start', -1)]).limit(1))).pop()
+
+    @cached(lambda team_name, ending_after, include_issues, res: (
+        [('sprints', team_name)] +
+        [('sprint', sprint['_id']) for sprint in res]))
+    def get_sprints(self, team_name, ending_after, include_issues=True):
+        db = self.read_db
         team_id = db.teams.find_one({'name': team_name})['_id']
-        return list(db.sprints.find(
+        sprints = list(db.sprints.find(
             {
                 'team_id': team_id,
                 'end': {
                     '$gte': ending_after}
-            }).sort([('start', -1)]))
-
-    def get_sprints_and_aux(self, team_name, ending_after):
-        db = self.client.sprints
+            },
+            projection=None if include_issues else {'issues': 0}
+            ).sort([('start', -1)]))
+        if include_issues:
+            sprints = self._with_issues(db, sprints)
+        return sprints
+
+    @cached(lambda team_name, ending_after, res: (
+        [('sprints', team_name)] +
+        [('sprint', sprint['_id']) for sprint in res]))
+    def get_sprint_throughputs(self, team_name, ending_after):
+        ''' Sprint names and dates with the number of issues finished in
+            each sprint, without loading the issues themselves.
+        '''
+        db = self.read_db
         team_id = db.teams.find_one({'name': team_name})['_id']
         return list(db.sprints.aggregate([
             {
@@ -128,6 +591,89 @@ class Client:
                     "end": {"$gte": ending_after}
                 }
             },
+            {
+                "$project": {
+                    "name": 1,
+                    "start": 1,
+                    "end": 1,
+                    # Sprints extracted before throughput was recorded
+                    # count their embedded issues instead.
+                    "throughput": {"$ifNull": [
+                        "$throughput",
+                        {"$size": {"$filter": {
+                            "input": {"$ifNull": ["$issues", []]},
+                            "cond": "$$this.finished_in_sprint"
+                        }}}
+                    ]}
+                }
+            },
+            {
+                "$sort": {"start": -1}
+            }
+        ]))
+
+    @cached(lambda team_names, ending_after, res: (
+        [('sprints', team_name) for team_name in team_names] +
+        [('sprint', sprint['_id'])
+         for sprints in res.values() for sprint in sprints] +
+        [('sprint_aux', sprint['_id'])
+         for sprints in res.values() for sprint in sprints]))
+    def get_teams_sprints_and_aux(self, team_names, ending_after):
+        ''' The sprints of many teams ending after ending_after, with
+            their auxillary data, in one teams query and one
+            aggregation however many teams there are.
+            Returns a mapping of team name to its sprints.
+        '''
+        db = self.client.sprints
+        team_names = tuple(team_names)
+        team_ids = {
+            team['_id']: team['name']
+            for team in db.teams.find({'name': {'$in': list(team_names)}})
+        }
+        missing = set(team_names) - set(team_ids.values())
+        if missing:
+            log.error(
+                'Teams %s do not exist, check the migrations files'
+                % ', '.join(sorted(missing)))
+
+        sprints_by_team = {
+            team_name: [] for team_name in team_names
+            if team_name not in missing}
+        for sprint in db.sprints.aggregate(
+                self._sprints_and_aux_pipeline({
+                    "team_id": {"$in": list(team_ids)},
+                    "end": {"$gte": ending_after}
+                })):
+            sprints_by_team[team_ids[sprint['team_id']]].append(sprint)
+        return sprints_by_team
+
+    @staticmethod
+    def _sprint_issues_page_pipeline(sprint_id, match, sort, skip, limit):
+        return [
+            {"$match": {"_id": sprint_id}},
+            {"$project": {"issues": 1}},
+            *SPRINT_ISSUES_LOOKUP,
+            {"$unwind": {"path": "$issues", "includeArrayIndex": "position"}},
+            # Position in the sprint, for a stable order among ties
+            {"$addFields": {"issues.position": "$position"}},
+            {"$replaceRoot": {"newRoot": "$issues"}},
+            {"$match": match},
+            {"$facet": {
+                "issues": [
+                    {"$sort": dict(list(sort) + [("position", 1)])},
+                    {"$skip": skip},
+                    {"$limit": limit}
+                ],
+                "total": [{"$count": "count"}]
+            }}
+        ]
+
+    @staticmethod
+    def _sprints_and_aux_pipeline(match):
+        return [
+            {
+                "$match": match
+            },
             {
                 "$lookup": {
                     "from": "sprints_aux",
@@ -136,16 +682,42 @@ class Client:
                     "as": "auxillary_data"
                 }
             },
+            *SPRINT_ISSUES_LOOKUP,
             {
                 "$sort": {"start": -1}
             }
-        ]))
+        ]
+
+    def _bump_reports_version(self, db):
+        # Any change to the reports behind the Metrics page moves this
+        # on, retiring the figures drawn from the previous version.
+        db.meta.update_one(
+            {'_id': 'reports'}, {'$inc': {'version': 1}}, upsert=True)
+
+    def get_reports_version(self):
+        # Not cached, it is what tells whether cached figures are current
+        doc = self.read_db.meta.find_one({'_id': 'reports'})
+        return doc['version'] if doc else 0
+
+    def get_metrics_figures(self, team_name, version):
+        doc = self.read_db.metrics_figures.find_one(
+            {'_id': team_name, 'version': version})
+        return doc['figures'] if doc else None
+
+    def put_metrics_figures(self, team_name, version, figures):
+        db = self.client.sprints
+        db.metrics_figures.replace_one(
+            {'_id': team_name},
+            {'version': version, 'figures': figures},
+            upsert=True)
 
     def update_performance_report(self, sprint_id, data):
         db = self.client.sprints
         db.performance_reports.update_one(
             {'_id': sprint_id},
             {'$set': data})
+        self._bump_reports_version(db)
+        self.cache.invalidate(('performance_reports',))
 
     def update_performance_reports(self, sprint_reports):
         db = self.client.sprints
@@ -154,52 +726,164 @@ class Client:
         # sprint. But if people are late updateing a manual input such
         # as goal completion, it is useful to be able to replace existing
         # reports.
+        if not sprint_reports:
+            return
         replacements = [
             ReplaceOne(
                 {"_id": report['_id']}, report, upsert=True)
             for report in sprint_reports
         ]
         res = db.performance_reports.bulk_write(replacements)
+        self._bump_reports_version(db)
+        self.cache.invalidate(('performance_reports',))
 
         if res.bulk_api_result['writeErrors']:
             log.error(res.bulk_api_result['writeErrors'])
 
         log.debug('Updated recent sprint reports')
 
-    def get_performance_reports(self, ending_after):
-        db = self.client.sprints
+    @cached(lambda team_name, ending_after, version, res: [
+        ('performance_reports',)])
+    def get_performance_reports(self, team_name, ending_after, version):
+        ''' `version`, the reports version, is only part of the cache
+            key. The cache is only invalidated in the process that wrote,
+            so others must not draw a newer version from older reports.
+        '''
+        db = self.read_db
         return list(db.performance_reports.find(
-            {'end_date': {'$gte': ending_after}}
-            ).sort([('start_date', -1)]))
+            {
+                'team_name': team_name,
+                'end_date': {'$gte': ending_after}
+            }).sort([('start_date', -1)]))
 
     def update_bau_reports(self, bau_reports):
         db = self.client.sprints
 
         # FIXME: repetition with performance
+        if not bau_reports:
+            return
         replacements = [
             ReplaceOne(
                 {"_id": report['_id']}, report, upsert=True)
             for report in bau_reports
         ]
         res = db.bau_reports.bulk_write(replacements)
+        self._bump_reports_version(db)
 
         if res.bulk_api_result['writeErrors']:
             log.error(res.bulk_api_result['writeErrors'])
 
         log.debug('Updated recent sprint reports')
 
-    def get_bau_reports(self, ending_after):
+    def get_report_versions(self, sprint_ids):
+        ''' The sprint versions the stored performance and BAU reports
+            were generated from, as two {sprint_id: version} mappings.
+        '''
         db = self.client.sprints
-        return list(db.bau_reports.find(
-            {'end_date': {'$gte': ending_after}}
-            ).sort([('start_date', -1)]))
+        # Queried once per collection, so not left as an iterator
+        sprint_ids = list(sprint_ids)
+        return tuple(
+            {
+                report['_id']: report.get('sprint_version')
+                for report in collection.find(
+                    {'_id': {'$in': sprint_ids}},
+                    projection={'sprint_version': 1})
+            }
+            for collection in (db.performance_reports, db.bau_reports))
+
+    def update_reports(self, performance_reports, bau_reports):
+        ''' Write a report generation pass, both families at once. '''
+        log.info(
+            'Writing %d performance and %d BAU reports' % (
+                len(performance_reports), len(bau_reports)))
+        self.update_performance_reports(performance_reports)
+        self.update_bau_reports(bau_reports)
+
+    def refresh_bau_totals(self, team_names, ending_after):
+        ''' Recompute each team's BAU label counts over all of its BAU
+            reports ending after `ending_after`.
+        '''
+        db = self.client.sprints
+        team_names = list(team_names)
+        totals = {team_name: {} for team_name in team_names}
+        for team in db.bau_reports.aggregate([
+                {
+                    "$match": {
+                        "team_name": {"$in": team_names},
+                        "end_date": {"$gte": ending_after}
+                    }
+                },
+                {
+                    "$project": {
+                        "team_name": 1,
+                        "labels": {"$objectToArray": "$bau_summary"}
+                    }
+                },
+                {
+                    "$unwind": "$labels"
+                },
+                {
+                    "$group": {
+                        "_id": {
+                            "team_name": "$team_name",
+                            "label": "$labels.k"
+                        },
+                        "count": {"$sum": "$labels.v"}
+                    }
+                },
+                {
+                    "$sort": {"count": -1}
+                },
+                {
+                    "$group": {
+                        "_id": "$_id.team_name",
+                        "labels": {
+                            "$push": {"k": "$_id.label", "v": "$count"}
+                        }
+                    }
+                },
+                {
+                    "$project": {
+                        "bau_summary": {"$arrayToObject": "$labels"}
+                    }
+                }]):
+            totals[team['_id']] = team['bau_summary']
+
+        if not totals:
+            return
+        db.bau_totals.bulk_write([
+            ReplaceOne(
+                {'_id': team_name},
+                {
+                    '_id': team_name,
+                    'team_name': team_name,
+                    'ending_after': ending_after,
+                    'bau_summary': bau_summary
+                },
+                upsert=True)
+            for team_name, bau_summary in totals.items()
+        ])
+        self._bump_reports_version(db)
+        self.cache.invalidate(('bau_totals',))
+
+    @cached(lambda team_name, version, res: [('bau_totals',)])
+    def get_bau_totals(self, team_name, version):
+        ''' `version` is only part of the cache key, as for
+            `get_performance_reports`.
+        '''
+        db = self.read_db
+        return db.bau_totals.find_one({'_id': team_name}) or {}
 
 
 _client = None
+_client_pid = None
 
 
 def get_client():
-    global _client
-    if not _client:
+    global _client, _client_pid
+    # A forked process gets its own Client, and with it its own cache
+    # and lock, rather than sharing state copied from the parent.
+    if _client is None or _client_pid != os.getpid():
         _client = Client()
+        _client_pid = os.getpid()
     return _client
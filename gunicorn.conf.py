@@ -0,0 +1,11 @@
+# Picked up automatically by gunicorn when run from the project root.
+# Workers are forked from the master, each one connects to mongo itself
+# after the fork, see database.mongo.Client.client.
+
+
+def post_worker_init(worker):
+    from database.mongo import get_client
+    if get_client().warm_up():
+        worker.log.info('Database connection pool warmed up')
+    else:
+        worker.log.warning('Database unreachable at worker boot')
@@ -1,13 +1,5 @@
-from os import environ
-from config import config
-
-from .forecast import Forecast
-from .sprint import SprintReadWrite, Sprints, Metrics
-
-config.set(
-    'db',
-    environ.get('DB_HOST', 'localhost'),
-    int(environ.get('DB_PORT', 27017)),
-    environ.get('DB_USERNAME', 'root'),
-    environ.get('DB_PASSWORD', 'rootpassword'),
-    )
+from .forecast import Forecast, PortfolioForecast
+from .sprint import (
+    SprintAuxillary, SprintIssuesPage, SprintReadWrite, Sprints, TeamMetrics,
+    MetricsFigures)
+from .metrics_figures import TeamMetricsFigures
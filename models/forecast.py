@@ -1,79 +1,529 @@
 import arrow
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass
 from datetime import datetime
-from math import floor
+from functools import cached_property
+import hashlib
+from math import ceil, floor
+import multiprocessing
+import numpy as np
+import os
 import pandas as pd
-import random
+from threading import Lock
+from typing import Dict, Optional, Tuple
 
+from config import config
+from database.cache import TTLCache
 from database.mongo import get_client
+from reports.cycle_time import (
+    TRIM_QUANTILE, DaysTakenSketch, mk_cycle_time_stats, unpack_days_taken)
+
+
+PERCENTILES = (50, 60, 70, 80)
+
+# Forecasting modes: sum the days taken by each issue, or count the
+# sprints needed at the throughput of past sprints.
+CYCLE_TIME = 'cycle_time'
+THROUGHPUT = 'throughput'
+MODES = {
+    CYCLE_TIME: 'Cycle time per issue',
+    THROUGHPUT: 'Throughput per sprint',
+}
+
+# Used when there is no sprint to measure the sprint length from
+SPRINT_DAYS = 14
+
+# The most remaining issues forecast for one team, the cost of the
+# cycle time distribution grows with it.
+MAX_ISSUES = 1000
+
+
+def clamp_issues(remaining_issues):
+    ''' Remaining issues as typed in, a whole number from 0 to
+        MAX_ISSUES, the input's bounds are only a hint to the browser.
+    '''
+    if remaining_issues is None:
+        return None
+    try:
+        return min(max(int(remaining_issues), 0), MAX_ISSUES)
+    except (TypeError, ValueError):
+        return None
+
+
+class NotEnoughHistory(ValueError):
+    ''' A team hasn't delivered enough yet to forecast from '''
+
+
+# Portfolio forecasts drawing fewer samples than this run one team after
+# another, the pool's overhead outweighs what it saves.
+PARALLEL_MIN_SAMPLES = 10_000_000
+
+# Bound on the number of samples drawn at once, to cap memory use for
+# very large simulations.
+MAX_BLOCK_SAMPLES = 1_000_000
+
+
+def simulate_days_taken(pool, num_issues, simulations=1000, rng=None):
+    ''' Total days taken to deliver `num_issues`, drawing each issue's
+        days taken from `pool`, for each of `simulations` runs.
+    '''
+    rng = rng if rng is not None else np.random.default_rng()
+    pool = np.asarray(pool)
+    if not len(pool):
+        raise NotEnoughHistory('no days taken to simulate from')
+    totals = np.empty(simulations, dtype=pool.dtype)
+    block = max(1, MAX_BLOCK_SAMPLES // max(num_issues, 1))
+    for start in range(0, simulations, block):
+        stop = min(start + block, simulations)
+        totals[start:stop] = rng.choice(
+            pool, size=(stop - start, num_issues)).sum(axis=1)
+    return totals
+
+
+def simulate_throughput_paths(pool, num_issues, simulations=1000, rng=None):
+    ''' Cumulative issues delivered after each sprint, drawing each
+        sprint's throughput from `pool`, for each of `simulations` runs.
+        Runs are extended until every one has delivered `num_issues`.
+    '''
+    rng = rng if rng is not None else np.random.default_rng()
+    pool = np.asarray(pool)
+    if not len(pool) or pool.max() <= 0:
+        raise NotEnoughHistory('no sprint throughput to simulate from')
+    horizon = max(1, ceil(num_issues / pool.mean()))
+    paths = np.cumsum(rng.choice(pool, size=(simulations, horizon)), axis=1)
+    while paths[:, -1].min() < num_issues:
+        more = np.cumsum(rng.choice(pool, size=(simulations, horizon)), axis=1)
+        paths = np.hstack([paths, paths[:, -1:] + more])
+    return paths
+
+
+def sprints_taken(paths, num_issues):
+    ''' Sprints each simulated run took to deliver `num_issues`, at
+        least one.
+    '''
+    return (paths < num_issues).sum(axis=1) + 1
+
+
+def simulate_sprints_taken(pool, num_issues, simulations=1000, rng=None):
+    ''' Sprints taken to deliver `num_issues`, drawing each sprint's
+        throughput from `pool`, for each of `simulations` runs.
+    '''
+    return sprints_taken(
+        simulate_throughput_paths(pool, num_issues, simulations, rng),
+        num_issues)
+
+
+@dataclass
+class MonteCarloResult:
+    # Sorted, one total per simulation
+    days_taken: np.ndarray
+    percentiles: Dict[int, float]
+
+    @classmethod
+    def from_totals(cls, totals, percentiles=PERCENTILES):
+        totals = np.sort(totals)
+        return cls(
+            days_taken=totals,
+            percentiles=dict(zip(
+                percentiles,
+                np.percentile(totals, percentiles).tolist())))
+
+
+def simulate_totals(
+        mode, pool, num_issues, simulations=1000, rng=None,
+        sprint_days=SPRINT_DAYS):
+    ''' Simulated days taken to deliver `num_issues`, where `pool`
+        holds the days taken per issue in cycle time mode, or the issues
+        finished per sprint in throughput mode.
+    '''
+    if mode == THROUGHPUT:
+        return sprint_days * simulate_sprints_taken(
+            pool, num_issues, simulations, rng)
+    return simulate_days_taken(pool, num_issues, simulations, rng)
+
+
+@dataclass
+class TeamSimulation:
+    pool: np.ndarray
+    num_issues: int
+    sprint_days: int = SPRINT_DAYS
+
+
+@dataclass
+class PortfolioResult:
+    teams: Dict[str, MonteCarloResult]
+    # When every team has finished, teams working in parallel
+    joint: MonteCarloResult
+
+
+def _simulate_team(args):
+    mode, team, simulations, seed = args
+    return simulate_totals(
+        mode, team.pool, team.num_issues, simulations,
+        np.random.default_rng(seed), team.sprint_days)
+
+
+def simulate_portfolio(
+        teams, simulations=1000, mode=CYCLE_TIME, seed=None,
+        executor=None):
+    ''' Monte Carlo forecasts for several teams at once, from a dict of
+        team name to `TeamSimulation`, run on `executor` if given.
+
+        Each team gets an independent random stream, so results only
+        depend on `seed` and not on how the work is scheduled.
+    '''
+    names = list(teams)
+    seeds = np.random.SeedSequence(seed).spawn(len(names))
+    jobs = [
+        (mode, teams[name], simulations, team_seed)
+        for name, team_seed in zip(names, seeds)]
+    run = executor.map if executor is not None else map
+    totals = list(run(_simulate_team, jobs))
+    return PortfolioResult(
+        teams={
+            name: MonteCarloResult.from_totals(team_totals)
+            for name, team_totals in zip(names, totals)},
+        joint=MonteCarloResult.from_totals(np.max(totals, axis=0)))
+
+
+_executor = None
+_executor_pid = None
+_executor_lock = Lock()
+
+
+def simulation_pool_size():
+    ''' Simulation processes for each dashboard process. Gunicorn
+        workers can't share a pool, so unless SIMULATION_POOL_SIZE says
+        otherwise they split the CPUs between them.
+    '''
+    if os.environ.get('SIMULATION_POOL_SIZE'):
+        return int(os.environ['SIMULATION_POOL_SIZE'])
+    workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+    return max(1, (os.cpu_count() or 1) // workers)
+
+
+def _init_simulation_process(db_config):
+    # Started afresh rather than forked, so without the parent's config,
+    # unless re-importing __main__ (e.g. python app.py) already set it.
+    if db_config is None:
+        return
+    try:
+        config.get('db')
+    except ValueError:
+        config.set('db', **db_config)
+
+
+def get_executor():
+    ''' A process pool for simulations, one per (forked) process.
+
+        Its processes come from a fork server rather than being forked
+        from the threaded dashboard process.
+    '''
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            try:
+                db_config = asdict(config.get('db'))
+            except ValueError:
+                # e.g. simulating without a database
+                db_config = None
+            _executor = ProcessPoolExecutor(
+                max_workers=simulation_pool_size(),
+                mp_context=multiprocessing.get_context('forkserver'),
+                initializer=_init_simulation_process,
+                initargs=(db_config,))
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def reset_executor(executor):
+    ''' Replace a broken pool on its next use '''
+    global _executor
+    with _executor_lock:
+        if _executor is executor:
+            _executor = None
+
+
+def mk_throughput_df(sprints_data):
+    ''' Cumulative throughput, oldest sprint first, from sprints given
+        newest first.
+    '''
+    sprints_data = sprints_data[::-1]
+    ends = [sprint['end'] for sprint in sprints_data]
+    return pd.DataFrame({
+        'name': [sprint['name'] for sprint in sprints_data],
+        'end': ends,
+        'end_ordinal': [end.toordinal() for end in ends],
+        'throughput': np.cumsum(
+            [sprint['throughput'] for sprint in sprints_data], dtype=int)
+    })
+
+
+class CycleTimeDistribution:
+    ''' The exact distribution of the total days taken to deliver n
+        issues, for every n up to `max_issues`, assuming each issue's days
+        taken is drawn independently from the empirical distribution of
+        `days_taken`.
+
+        The distribution for n issues is the n-fold convolution of the
+        days taken histogram with itself, built up by repeated
+        multiplication in the frequency domain. Percentiles 1-99 are
+        tabulated as we go, so lookups are constant time afterwards.
+    '''
+    def __init__(self, days_taken, max_issues):
+        days_taken = np.rint(np.asarray(days_taken)).astype(int)
+        if not len(days_taken):
+            raise NotEnoughHistory(
+                'no days taken to build a distribution from')
+        if max_issues < 1:
+            raise ValueError('max_issues must be at least 1')
+        self.max_issues = max_issues
+
+        pmf = np.bincount(days_taken) / len(days_taken)
+        # Every sum of n issues fits in n * max days + 1 bins, pad to a
+        # power of two for the FFT so the convolution isn't circular.
+        max_total = max_issues * (len(pmf) - 1)
+        n_fft = 1 << max_total.bit_length()
+        spectrum = np.fft.rfft(pmf, n_fft)
+
+        quantiles = np.arange(1, 100) / 100
+        self._table = np.empty((max_issues, len(quantiles)), dtype=int)
+        power = np.ones_like(spectrum)
+        for n in range(1, max_issues + 1):
+            power *= spectrum
+            sum_pmf = np.fft.irfft(power, n_fft)[:n * (len(pmf) - 1) + 1]
+            cdf = np.cumsum(np.clip(sum_pmf, 0, None))
+            cdf /= cdf[-1]
+            self._table[n - 1] = np.searchsorted(cdf, quantiles - 1e-9)
+
+    def percentile(self, num_issues, percent):
+        ''' Days within which `num_issues` are delivered with `percent`%
+            confidence, for whole percentages 1 to 99.
+        '''
+        if not 1 <= num_issues <= self.max_issues:
+            raise ValueError(
+                f'num_issues must be between 1 and {self.max_issues}')
+        return int(self._table[num_issues - 1, percent - 1])
+
+    def percentile_curve(self, percent):
+        ''' Days taken at `percent`% confidence for 1..max_issues '''
+        return self._table[:, percent - 1]
+
+
+def forecast_key_id(key):
+    return hashlib.sha1(repr(key).encode()).hexdigest()
+
+
+def forecast_seed(key):
+    ''' Seed for a forecast's random draws, so repeating a forecast
+        against the same data always gives the same numbers.
+    '''
+    return int(forecast_key_id(key), 16)
+
+
+# Results are keyed by the version of the data they came from so never
+# go stale, they only leave the cache to make room.
+_forecast_results = TTLCache(ttl=float('inf'), max_size=256)
+
+
+def get_forecast_result(key, compute):
+    ''' The {percentile: curve} result for `key`, from memory, then
+        mongo if forecasts are persisted, else computed.
+    '''
+    result = _forecast_results.get(key)
+    if result is not None:
+        return result
+    db_client = get_client()
+    persist = db_client.conn_info.persist_forecasts
+    stored = (
+        db_client.get_forecast_result(forecast_key_id(key)) if persist
+        else None)
+    if stored is not None:
+        result = {
+            int(percent): np.array(curve)
+            for percent, curve in stored.items()}
+    else:
+        result = compute()
+        if persist:
+            db_client.put_forecast_result(forecast_key_id(key), {
+                str(percent): curve.tolist()
+                for percent, curve in result.items()})
+    _forecast_results.set(key, result)
+    return result
+
+
+@dataclass
+class ForecastState:
+    ''' Everything a team's forecasts are derived from, prepared once
+        per version of the underlying data.
+    '''
+    version: tuple
+    days_taken_pool: np.ndarray
+    # Issues by days taken, without outliers
+    sketch: DaysTakenSketch
+    throughput_df: pd.DataFrame
+    gradients: Optional[Tuple[float, float]]
+    # Issues finished in each sprint, and the typical sprint length
+    throughput_pool: np.ndarray
+    sprint_days: int
+
+
+_forecast_states = {}
+_forecast_states_lock = Lock()
+
+
+def mk_forecast_state(db_client, team_name, ending_after, version):
+    # Make sure we load the data the version was taken from, rather
+    # than a cached copy from before an ETL run in another process.
+    db_client.cache.invalidate(
+        ('cycle_time_stats', team_name), ('days_taken_sketch', team_name),
+        ('sprints', team_name))
+    sprints_data = db_client.get_sprint_throughputs(team_name, ending_after)
+    throughput_df = mk_throughput_df(sprints_data)
+    sprint_lengths = [
+        (sprint['end'] - sprint['start']).days for sprint in sprints_data]
+
+    stats = db_client.get_cycle_time_stats(team_name)
+    if stats is None:
+        # Issues extracted before the stats were, work them out here
+        stats = mk_cycle_time_stats(
+            issue['days_taken']
+            for issue in db_client.get_historic_issues(team_name))
+    sketches = db_client.get_days_taken_sketches((team_name,))
+    return ForecastState(
+        version=version,
+        days_taken_pool=unpack_days_taken(stats),
+        sketch=(
+            DaysTakenSketch.from_mongo(sketches[0]).trimmed() if sketches
+            # the stats histogram is already trimmed
+            else DaysTakenSketch(stats['histogram'])),
+        throughput_df=throughput_df,
+        gradients=(
+            Forecast.minmax_gradients(throughput_df)
+            if len(throughput_df) > 1 else None),
+        throughput_pool=np.array(
+            [sprint['throughput'] for sprint in sprints_data], dtype=int),
+        sprint_days=(
+            int(np.median(sprint_lengths)) if sprint_lengths
+            else SPRINT_DAYS))
+
+
+def get_forecast_state(team_name):
+    ''' The prepared forecast state for a team, only rebuilt when its
+        historic issues or sprints have changed.
+    '''
+    db_client = get_client()
+    six_sprints_ago = arrow.utcnow().shift(weeks=-12).floor('day').datetime
+    version = db_client.get_forecast_data_version(
+        team_name, six_sprints_ago)
+    state = _forecast_states.get(team_name)
+    if state is not None and state.version == version:
+        return state
+    with _forecast_states_lock:
+        state = _forecast_states.get(team_name)
+        if state is None or state.version != version:
+            state = mk_forecast_state(
+                db_client, team_name, six_sprints_ago, version)
+            _forecast_states[team_name] = state
+    return state
 
 
 class Forecast:
     def __init__(self, team_name):
-        self.db_client = get_client()
-        six_sprints_ago = arrow.utcnow().shift(weeks=-12).datetime
-        self._sprints_data = self.db_client.get_sprints(
-            team_name, six_sprints_ago)
-
-        self._historic_data = self.db_client.get_historic_issues(team_name)
-        df = pd.DataFrame.from_records(self._historic_data)
-        # FIXME:
-        # 1) make the cap configurable?
-        # 2) remove top 95%
-        self.historic_df = df[df.days_taken < df.days_taken.quantile(0.95)]
-
-    def run_montecarlo(self, num_issues):
-        records = []
-        pool = list(self.historic_df['days_taken'].dropna())
-        for simulation in range(1000):
-            days_taken = sum([
-                random.choice(pool)
-                for _ in range(num_issues)])
-            records.append({
-                "simulation": simulation,
-                "days_taken": days_taken})
+        self.team_name = team_name
+        self.state = get_forecast_state(team_name)
+        self.days_taken_pool = self.state.days_taken_pool
+
+    @cached_property
+    def historic_df(self):
+        ''' The team's historic issues, without outliers. Only loaded
+            for plotting individual issues.
+        '''
         df = pd.DataFrame.from_records(
-            records).sort_values('days_taken').reset_index(drop=True)
-        return df
+            get_client().get_historic_issues(self.team_name))
+        return df[df.days_taken < df.days_taken.quantile(TRIM_QUANTILE)]
+
+    def percentile(self, percent):
+        ''' Days taken by an issue at `percent`% '''
+        return float(self.state.sketch.percentile(percent))
+
+    def run_montecarlo(
+            self, num_issues, simulations=1000, rng=None, mode=CYCLE_TIME):
+        ''' Days taken to deliver `num_issues`, by summing sampled issue
+            cycle times or by counting sprints of sampled throughput.
+        '''
+        return MonteCarloResult.from_totals(simulate_totals(
+            mode, self.montecarlo_pool(mode), num_issues, simulations, rng,
+            self.state.sprint_days))
+
+    def montecarlo_pool(self, mode=CYCLE_TIME):
+        if mode == THROUGHPUT:
+            return self.state.throughput_pool
+        return self.days_taken_pool
+
+    def cycle_time_distribution(self, max_issues):
+        return CycleTimeDistribution(self.days_taken_pool, max_issues)
+
+    def confidence_curves(
+            self, max_issues, percentiles=PERCENTILES, mode=CYCLE_TIME,
+            simulations=1000):
+        ''' Days taken to deliver 1..max_issues at each percentile.
+
+            In throughput mode one set of simulated sprints answers every
+            issue count, as each run delivers them all in turn.
+        '''
+        if not 1 <= max_issues <= MAX_ISSUES:
+            raise ValueError(f'max_issues must be from 1 to {MAX_ISSUES}')
+        key = (
+            'confidence_curves', self.team_name, max_issues,
+            tuple(percentiles), mode, simulations, self.state.version)
+        if mode == THROUGHPUT:
+            return get_forecast_result(
+                key, lambda: self._throughput_curves(
+                    max_issues, percentiles, simulations,
+                    np.random.default_rng(forecast_seed(key))))
+        return get_forecast_result(
+            key, lambda: self._cycle_time_curves(max_issues, percentiles))
+
+    def _throughput_curves(self, max_issues, percentiles, simulations, rng):
+        paths = simulate_throughput_paths(
+            self.state.throughput_pool, max_issues, simulations, rng)
+        sprints = np.array([
+            sprints_taken(paths, num_issues)
+            for num_issues in range(1, max_issues + 1)])
+        return {
+            percent: np.ceil(self.state.sprint_days * np.percentile(
+                sprints, percent, axis=1)).astype(int)
+            for percent in percentiles}
+
+    def _cycle_time_curves(self, max_issues, percentiles):
+        distribution = self.cycle_time_distribution(max_issues)
+        return {
+            percent: distribution.percentile_curve(percent)
+            for percent in percentiles}
 
     def throughput_df(self):
-        df = pd.DataFrame()
-        throughput = 0
-        for sprint in reversed(self._sprints_data):
-            throughput += len(
-                [i for i in sprint['issues']
-                 if i['finished_in_sprint']])
-            df = df.append(
-                {
-                    'name': sprint['name'],
-                    'end': sprint['end'],
-                    'end_ordinal': sprint['end'].toordinal(),
-                    'throughput': throughput
-                },
-                ignore_index=True)
-        return df
+        return self.state.throughput_df
 
     @staticmethod
-    def gradient(start_y, end_y, start_x, end_x):
-        return (end_y - start_y) / (end_x - start_x)
-
-    def minmax_gradients(self, df):
-        origin_time = df.at[0, 'end_ordinal']
-        origin_throughput = df.at[0, 'throughput']
-
-        grads = []
-        for index, row, in df.iterrows():
-            if index == 0:
-                continue
-            grad = self.gradient(
-                origin_throughput, row['throughput'],
-                origin_time, row['end_ordinal']
-            )
-            grads.append(grad)
-        return min(grads), max(grads)
-
-    def uncertainty_cone_coords(self, end_y):
+    def minmax_gradients(df):
+        ''' The shallowest and steepest throughput gradients from the
+            first sprint to each later one.
+        '''
+        x = df['end_ordinal'].to_numpy()
+        y = df['throughput'].to_numpy()
+        grads = (y[1:] - y[0]) / (x[1:] - x[0])
+        return grads.min(), grads.max()
+
+    def uncertainty_cone_coords(self, remaining_issues):
+        ''' Lines from the first sprint to the delivery of the remaining
+            issues, at the shallowest and steepest throughput gradients.
+        '''
+        if self.state.gradients is None or min(self.state.gradients) <= 0:
+            raise NotEnoughHistory('not enough sprints with throughput')
         df = self.throughput_df()
-        min_g, max_g = self.minmax_gradients(df)
+        min_g, max_g = self.state.gradients
+        end_y = df.iloc[-1]['throughput'] + remaining_issues
         start_x = df.iloc[0]['end']
         start_y = df.iloc[0]['throughput']
         start_x_ord = df.iloc[0]['end_ordinal']
@@ -84,3 +534,69 @@ class Forecast:
         return (
             (start_x, start_y, datetime.fromordinal(x2), end_y),
             (start_x, start_y, datetime.fromordinal(x1), end_y))
+
+
+class PortfolioForecast:
+    ''' When several teams will all have finished their remaining
+        issues, given as a dict of team name to remaining issues.
+    '''
+    def __init__(self, remaining_by_team):
+        self.remaining_by_team = dict(remaining_by_team)
+        self.forecasts = {
+            team_name: Forecast(team_name)
+            for team_name in self.remaining_by_team}
+
+    def run_montecarlo(
+            self, simulations=1000, mode=CYCLE_TIME, seed=None,
+            executor=None):
+        teams = {
+            team_name: TeamSimulation(
+                forecast.montecarlo_pool(mode),
+                self.remaining_by_team[team_name],
+                forecast.state.sprint_days)
+            for team_name, forecast in self.forecasts.items()}
+        for team_name, team in teams.items():
+            if not len(team.pool):
+                raise NotEnoughHistory(
+                    f'{team_name} has no history to simulate from')
+        if executor is None and self.worth_a_pool(teams, simulations):
+            executor = get_executor()
+        return simulate_portfolio(teams, simulations, mode, seed, executor)
+
+    @staticmethod
+    def worth_a_pool(teams, simulations):
+        ''' Whether running the teams across the process pool beats
+            running them one after another, it can't with a single
+            process or small forecasts.
+        '''
+        samples = simulations * sum(
+            team.num_issues for team in teams.values())
+        return (
+            len(teams) > 1 and simulation_pool_size() > 1 and
+            samples >= PARALLEL_MIN_SAMPLES)
+
+    def forecast(self, simulations=1000, mode=CYCLE_TIME):
+        ''' `run_montecarlo` seeded from what is forecast, so every view
+            of the same teams and data gets the same numbers, kept in
+            memory with the other forecast results.
+        '''
+        key = (
+            'portfolio',
+            tuple(
+                (team_name, remaining_issues,
+                 self.forecasts[team_name].state.version)
+                for team_name, remaining_issues
+                in self.remaining_by_team.items()),
+            simulations, mode)
+        result = _forecast_results.get(key)
+        if result is None:
+            result = self.run_montecarlo(
+                simulations, mode, seed=forecast_seed(key))
+            _forecast_results.set(key, result)
+        return result
+
+    def cycle_time_sketch(self):
+        ''' Issues by days taken across all the teams '''
+        return sum(
+            (forecast.state.sketch for forecast in self.forecasts.values()),
+            DaysTakenSketch())
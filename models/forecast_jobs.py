@@ -0,0 +1,116 @@
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+from functools import partial
+import hashlib
+import logging
+
+import numpy as np
+
+from database.mongo import get_client
+from .forecast import (
+    CYCLE_TIME, MonteCarloResult, get_executor, reset_executor,
+    simulate_totals)
+
+
+log = logging.getLogger(__name__)
+
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+JOB_SIMULATIONS = 10000
+# Simulations between progress updates
+JOB_BLOCK_SIMULATIONS = 1000
+# A running job not heard from for this long is assumed abandoned
+JOB_TIMEOUT = timedelta(minutes=10)
+
+
+def forecast_job_id(team_name, num_issues, mode, simulations, version):
+    ''' Identical requests against the same data share a job '''
+    key = repr((team_name, num_issues, mode, simulations, version))
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def run_forecast_job(
+        job_id, pool, num_issues, mode, simulations, sprint_days):
+    ''' Runs in a worker process, recording progress as it goes. '''
+    db_client = get_client()
+    try:
+        # Seeded by the job, so a rerun gives the same result
+        rng = np.random.default_rng(int(job_id, 16))
+        totals = []
+        for start in range(0, simulations, JOB_BLOCK_SIMULATIONS):
+            stop = min(start + JOB_BLOCK_SIMULATIONS, simulations)
+            totals.append(simulate_totals(
+                mode, pool, num_issues, stop - start, rng, sprint_days))
+            db_client.update_forecast_job(
+                job_id, progress=stop / simulations)
+        result = MonteCarloResult.from_totals(np.concatenate(totals))
+        days, counts = np.unique(result.days_taken, return_counts=True)
+        db_client.update_forecast_job(
+            job_id,
+            status=DONE,
+            percentiles={
+                str(percent): days_taken
+                for percent, days_taken in result.percentiles.items()},
+            histogram={'days': days.tolist(), 'counts': counts.tolist()})
+    except Exception as e:
+        log.exception('Forecast job %s failed' % job_id)
+        db_client.update_forecast_job(job_id, status=FAILED, error=str(e))
+
+
+def submit_forecast_job(
+        forecast, num_issues, mode=CYCLE_TIME, simulations=JOB_SIMULATIONS):
+    ''' The job forecasting `num_issues` for a `Forecast` model, started
+        on the simulation pool unless an identical one already exists.
+    '''
+    db_client = get_client()
+    job_id = forecast_job_id(
+        forecast.team_name, num_issues, mode, simulations,
+        forecast.state.version)
+    job = {
+        'team_name': forecast.team_name,
+        'num_issues': num_issues,
+        'mode': mode,
+        'simulations': simulations,
+        'status': RUNNING,
+        'progress': 0.0,
+    }
+    existing = db_client.start_forecast_job(job_id, job)
+    if existing is not None:
+        abandoned = (
+            existing['status'] == RUNNING and
+            existing['updated'] < datetime.utcnow() - JOB_TIMEOUT)
+        if existing['status'] != FAILED and not abandoned:
+            return existing
+        if not db_client.restart_forecast_job(
+                job_id, existing['updated'], job):
+            return db_client.get_forecast_job(job_id)
+    executor = get_executor()
+    try:
+        future = executor.submit(
+            run_forecast_job, job_id, forecast.montecarlo_pool(mode),
+            num_issues, mode, simulations, forecast.state.sprint_days)
+    except Exception as e:
+        future = Future()
+        future.set_exception(e)
+    future.add_done_callback(partial(forecast_job_done, job_id, executor))
+    return dict(job, _id=job_id)
+
+
+def forecast_job_done(job_id, executor, future):
+    ''' Jobs record their own failures, this records those of the pool
+        running them, rather than leaving the job to time out.
+    '''
+    error = future.exception()
+    if error is None:
+        return
+    log.error('Forecast job %s did not run: %s' % (job_id, error))
+    get_client().update_forecast_job(job_id, status=FAILED, error=str(error))
+    if isinstance(error, BrokenProcessPool):
+        reset_executor(executor)
+
+
+def get_forecast_job(job_id):
+    return get_client().get_forecast_job(job_id)
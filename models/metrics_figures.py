@@ -0,0 +1,147 @@
+import plotly.graph_objects as go
+from plotly.subplots import make_subplots
+
+from colours import GOOD
+from .sprint import MetricsFigures, TeamMetrics
+
+
+def _mk_sub_pie_trace(label_counts):
+    return go.Pie(
+        labels=list(label_counts.keys()),
+        values=list(label_counts.values()),
+        scalegroup='one')
+
+
+def _mk_sub_bar_trace(
+        df, name, x_col, y_col, color='blue', show_legend=False):
+    fig = go.Bar(
+        x=df[x_col].tolist(),
+        y=df[y_col].tolist(),
+        name=name,
+        marker={'color': color},
+        showlegend=show_legend,
+        legendgroup=name)
+    return fig
+
+
+def _mk_sub_line_trace(
+        df, name, x_col, y_col, color='blue', show_legend=False):
+    fig = go.Scatter(
+        x=df[x_col].tolist(),
+        y=df[y_col].tolist(),
+        name=name,
+        marker={'color': color},
+        showlegend=show_legend,
+        legendgroup=name)
+    return fig
+
+
+def mk_gauge_trace(df):
+    val = int(df.goal_completed.mean().round(0))
+    if val < 60:
+        color = 'red'
+    elif val < 80:
+        color = 'orange'
+    else:
+        color = 'green'
+    fig = go.Indicator(
+        value=val,
+        number={'font': {'color': color}},
+        title={
+            'text': "Goal Completion %",
+            'font': {'size': 12}}
+    )
+    return fig
+
+
+class TeamMetricsFigures:
+    ''' A team's Metrics panel figures, for the dashboard and for the
+        report ETL to draw ahead of it.
+    '''
+    # Shared by every request this process serves
+    figures_cache = MetricsFigures()
+
+    def __init__(self, team_name):
+        self.team_name = team_name
+        self.model = None
+
+    def mk_figures(self, version):
+        # Only loaded when the cached figures are out of date, from
+        # reports at least as new as `version`
+        self.model = TeamMetrics(self.team_name, version)
+        return {
+            'delivery': self.mk_delivery_summary_figure().to_json(),
+            'bau': self.mk_bau_overview_figure().to_json()
+        }
+
+    def figures(self):
+        return self.figures_cache.get(self.team_name, self.mk_figures)
+
+    def mk_bau_overview_figure(self):
+        fig = go.Figure(_mk_sub_pie_trace(self.model.bau_summary))
+        fig.update_layout(
+            legend_x=1,
+            legend_y=1,
+            height=300,
+            margin=dict(t=0, b=0, r=0, l=0))
+        fig.update_traces(
+            textinfo='percent', showlegend=True)
+        fig.update_layout(transition_duration=500)
+        return fig
+
+    @staticmethod
+    def add_sprint_delivery_traces(df, row, col, show_legend, fig):
+        fig.add_trace(
+            _mk_sub_line_trace(
+                df,
+                name='BAU %',
+                x_col='end_date',
+                y_col='bau_issues_percentage',
+                color='orange',
+                show_legend=show_legend),
+            row=row, col=col)
+        fig.add_trace(
+            _mk_sub_line_trace(
+                df,
+                name='Delivery %',
+                x_col='end_date',
+                y_col='roadmap_delivered_issues_percentage',
+                color=GOOD,
+                show_legend=show_legend),
+            row=row, col=col)
+        fig.add_trace(
+            _mk_sub_bar_trace(
+                df,
+                name='Goal completed',
+                x_col='end_date',
+                y_col='goal_completed',
+                color='#90ee90',
+                show_legend=show_legend),
+            row=row, col=col)
+
+    @staticmethod
+    def add_gauge_trace(df, row, col, fig):
+        fig.add_trace(mk_gauge_trace(df), row, col)
+
+    def mk_delivery_summary_figure(self):
+        df = self.model.sprint_performance_report_df()
+
+        fig = make_subplots(
+            rows=2, cols=1,
+            specs=[[{}], [{'type': 'indicator'}]],
+            row_heights=[0.7, 0.3])
+
+        # A team without reports in the window gets empty axes
+        if not df.empty:
+            df = df.sort_values('start_date')
+            self.add_sprint_delivery_traces(df, 1, 1, True, fig)
+            self.add_gauge_trace(df, 2, 1, fig)
+
+        fig.update_layout(
+            legend_orientation='h',
+            height=400,
+            margin=dict(t=20, b=20, r=0, l=0),
+            )
+        fig.update_layout(transition_duration=500)
+        fig.update_yaxes(ticksuffix='%', row=1, col=1)
+        return fig
@@ -1,5 +1,9 @@
 import arrow
+import json
+from math import ceil
 import pandas as pd
+import re
+from threading import Lock
 import plotly.graph_objects as go
 
 from database.mongo import get_client
@@ -34,6 +38,15 @@ class SprintReadOnly:
     def mk_issues_summary_df(self):
         return mk_issues_summary_df(self._data)
 
+    def mk_details_page(self, page_size):
+        ''' The first page of the details table, in issue order, and
+            the number of pages.
+        '''
+        issues = self._data['issues']
+        return (
+            mk_details_records(issues[:page_size]),
+            max(1, ceil(len(issues) / page_size)))
+
     def mk_bau_breakdown_df(self):
         bau = []
         for bau_category in self.issues_df[
@@ -43,71 +56,246 @@ class SprintReadOnly:
         return df
 
 
-class SprintReadWrite(SprintReadOnly):
+class SprintAuxillary:
+    ''' The data users add to a sprint, its goal completion and notes,
+        without loading the sprint itself.
+    '''
     def __init__(self, sprint_id):
         self.db_client = get_client()
-        super().__init__(
-            self.db_client.get_sprint(sprint_id),
-            self.db_client.get_sprint_auxillary_data(sprint_id)
-        )
+        self.sprint_id = sprint_id
+        self.data = self.db_client.get_sprint_auxillary_data(sprint_id)
+
+    @property
+    def goal_completed(self):
+        return bool(self.data.get('goal_completed'))
+
+    @property
+    def notes(self):
+        return self.data.get('notes')
+
+    def _save(self, **fields):
+        self.db_client.update_sprint_auxillary_data(self.sprint_id, fields)
+        # Updated in place, rather than read back, and shared with the
+        # SprintReadWrite this may belong to.
+        self.data.update(fields)
 
     def update_goal_completion(self, goal_completion_val):
+        # Compared with data just read from the primary, not a cached
+        # copy another process may have saved over.
+        if goal_completion_val == self.goal_completed:
+            return
         # FIXME: potential data-race under load.
         # Updating two documents outside of transaction.
         # Highly unlikely to be a problem with current usage.
         # Symptoms: sprint and performance_reports have inconsistent
         # goal completion values.
-        self.db_client.update_sprint_auxillary_data(
-            self._data['_id'],
-            {
-                'goal_completed': goal_completion_val,
-                'notes': self.notes
-            }
-        )
+        self._save(goal_completed=goal_completion_val)
         self.db_client.update_performance_report(
-            self._data['_id'],
+            self.sprint_id,
             {'goal_completed': self.goal_completion_as_int(
                 goal_completion_val)})
-        sprint = SprintReadWrite(self._data['_id'])
-        return sprint
 
     @staticmethod
     def goal_completion_as_int(goal_completed):
         return 100 if goal_completed else 0
 
     def save_notes(self, notes):
-        self.db_client.update_sprint_auxillary_data(
-            self._data['_id'],
-            {
-                'goal_completed': self.goal_completed,
-                'notes': notes
-            }
+        self._save(notes=notes)
+
+
+class SprintReadWrite(SprintReadOnly):
+    def __init__(self, sprint_id):
+        self.db_client = get_client()
+        self.auxillary = SprintAuxillary(sprint_id)
+        super().__init__(
+            self.db_client.get_sprint(sprint_id),
+            self.auxillary.data
         )
-        return SprintReadWrite(self._data['_id'])
+
+    def update_goal_completion(self, goal_completion_val):
+        self.auxillary.update_goal_completion(goal_completion_val)
+        return self
+
+    def save_notes(self, notes):
+        self.auxillary.save_notes(notes)
+        return self
+
+
+# Sprint details table columns, and the issue fields they show
+DETAILS_COLUMNS = {
+    'name': 'name',
+    'description': 'description',
+    'planned': 'planned',
+    'delivered': 'finished_in_sprint',
+    'bau': 'bau',
+}
+BOOLEAN_COLUMNS = {'planned', 'delivered', 'bau'}
+
+# DataTable filter operators, by their spellings
+FILTER_OPERATORS = {
+    '>=': 'ge', 'ge': 'ge',
+    '<=': 'le', 'le': 'le',
+    '<': 'lt', 'lt': 'lt',
+    '>': 'gt', 'gt': 'gt',
+    '!=': 'ne', 'ne': 'ne',
+    '=': 'eq', 'eq': 'eq',
+    'contains': 'contains',
+    'datestartswith': 'datestartswith',
+}
+# Operators whose value is text to search for, never a number
+TEXT_OPERATORS = {'contains', 'datestartswith'}
+# The operator is only looked for straight after the {column}, so that
+# search text can contain anything, e.g. '{name} contains "a >= b"'.
+FILTER_PART = re.compile(
+    r'^\s*\{(?P<column>[^}]*)\}\s*'
+    r'(?:(?P<symbol>>=|<=|!=|<|>|=)\s*'
+    r'|(?P<word>ge|le|lt|gt|ne|eq|contains|datestartswith)\s+)'
+    r'(?P<value>.*?)\s*$')
+MONGO_COMPARISONS = {
+    'ge': '$gte', 'le': '$lte', 'lt': '$lt', 'gt': '$gt', 'ne': '$ne'}
+
+
+def split_filter_part(filter_part):
+    ''' (column, operator, value) from one clause of a DataTable
+        filter query, e.g. '{name} contains "ABC"'.
+    '''
+    parsed = FILTER_PART.match(filter_part)
+    if parsed is None:
+        return None, None, None
+    operator = FILTER_OPERATORS[parsed['symbol'] or parsed['word']]
+    value_part = parsed['value']
+    quote = value_part[:1]
+    if (len(value_part) > 1 and quote in ('"', "'", '`') and
+            value_part[-1] == quote):
+        value = value_part[1:-1].replace('\\' + quote, quote)
+    elif operator in TEXT_OPERATORS:
+        value = value_part
+    else:
+        try:
+            value = float(value_part)
+        except ValueError:
+            value = value_part
+    return parsed['column'], operator, value
+
+
+def mk_issues_match(filter_query):
+    ''' A mongo query for the issues a DataTable filter query selects '''
+    match = {}
+    for filter_part in (filter_query or '').split(' && '):
+        column, operator, value = split_filter_part(filter_part)
+        if column not in DETAILS_COLUMNS:
+            continue
+        field = DETAILS_COLUMNS[column]
+        if column in BOOLEAN_COLUMNS:
+            value = str(value).lower() == 'true'
+            if operator == 'contains':
+                operator = 'eq'
+        if operator == 'eq':
+            match[field] = value
+        elif operator == 'contains':
+            match[field] = {
+                '$regex': re.escape(str(value)), '$options': 'i'}
+        elif operator == 'datestartswith':
+            match[field] = {'$regex': '^' + re.escape(str(value))}
+        else:
+            match.setdefault(field, {})[MONGO_COMPARISONS[operator]] = value
+    return match
+
+
+def mk_issues_sort(sort_by):
+    return [
+        (DETAILS_COLUMNS[sort['column_id']],
+         1 if sort['direction'] == 'asc' else -1)
+        for sort in sort_by or []
+        if sort['column_id'] in DETAILS_COLUMNS]
+
+
+def mk_details_records(issues):
+    return [
+        {column: issue.get(field) for column, field in DETAILS_COLUMNS.items()}
+        for issue in issues]
+
+
+class SprintIssuesPage:
+    ''' A page of a sprint's issues, for the details table, filtered,
+        sorted and paged by mongo.
+    '''
+    def __init__(
+            self, sprint_id, page_current, page_size,
+            sort_by=None, filter_query=None):
+        self.db_client = get_client()
+        issues, total = self.db_client.get_sprint_issues_page(
+            sprint_id,
+            mk_issues_match(filter_query),
+            mk_issues_sort(sort_by),
+            page_current * page_size,
+            page_size)
+        self.records = mk_details_records(issues)
+        self.page_count = max(1, ceil(total / page_size))
 
 
 class Sprints:
     def __init__(self, team_name):
         self.db_client = get_client()
-        six_sprints_ago = arrow.utcnow().shift(weeks=-12).datetime
+        # Floored so that repeat queries within a day share a cache key
+        six_sprints_ago = arrow.utcnow().shift(
+            weeks=-12).floor('day').datetime
         self.refs = {
             s['_id']: s['name']
             for s in self.db_client.get_sprints(
-                team_name, six_sprints_ago)
+                team_name, six_sprints_ago, include_issues=False)
         }
 
 
-class Metrics:
-    def __init__(self):
+class TeamMetrics:
+    ''' A team's reports for its Metrics panel, its last six sprints and
+        BAU totals, selected by mongo rather than from every team's.
+    '''
+    def __init__(self, team_name, version):
         self.db_client = get_client()
-        six_sprints_ago = arrow.utcnow().shift(weeks=-12).datetime
+        self.team_name = team_name
+        six_sprints_ago = arrow.utcnow().shift(
+            weeks=-12).floor('day').datetime
         self.sprint_reports = self.db_client.get_performance_reports(
-            ending_after=six_sprints_ago)
-        self.bau_reports = self.db_client.get_bau_reports(
-            ending_after=six_sprints_ago)
+            team_name, six_sprints_ago, version)
+        self.bau_summary = self.db_client.get_bau_totals(
+            team_name, version).get('bau_summary', {})
 
     def sprint_performance_report_df(self):
         return pd.DataFrame.from_records(self.sprint_reports)
 
-    def sprint_bau_report_df(self):
-        return pd.DataFrame.from_records(self.bau_reports)
+
+class MetricsFigures:
+    ''' The Metrics page figures, serialised, by team and for the
+        version of the reports they were drawn from.
+
+        Kept in memory for this process and in mongo for all of them,
+        so that the report ETL can draw them once as soon as the reports
+        change and the dashboard serves them without redrawing.
+    '''
+    def __init__(self):
+        self._figures = {}
+        self._lock = Lock()
+
+    def get(self, team_name, draw):
+        ''' The team's current figures, as plain dicts, calling `draw`
+            with the reports version for a {name: figure json} mapping if
+            they are out of date.
+        '''
+        db_client = get_client()
+        version = db_client.get_reports_version()
+        with self._lock:
+            current = self._figures.get(team_name)
+        if current is not None and current[0] == version:
+            return current[1]
+        # Drawn outside the lock so that the panels of different teams
+        # load in parallel, at worst a team is drawn twice.
+        figures = db_client.get_metrics_figures(team_name, version)
+        if figures is None:
+            figures = draw(version)
+            db_client.put_metrics_figures(team_name, version, figures)
+        figures = {
+            name: json.loads(figure) for name, figure in figures.items()}
+        with self._lock:
+            self._figures[team_name] = (version, figures)
+        return figures
@@ -0,0 +1,34 @@
+from database.mongo import get_client
+from .utils import (
+    TeamsSprintsAggregate, mk_bau_summaries_df, mk_sprint_summaries_df)
+
+
+def is_stale(sprint_data, report_versions):
+    report_version = report_versions.get(sprint_data['_id'])
+    return (
+        report_version is None or
+        report_version < sprint_data.get('version', 0))
+
+
+def create_reports(teams, num_sprints=6, force=False):
+    ''' Sprint performance and BAU reports for all teams, loading the
+        sprints only once for both, with a fixed number of queries.
+
+        Only reports generated from an older version of their sprint
+        (or never generated) are recomputed, unless `force` is set.
+    '''
+    agg = TeamsSprintsAggregate([team.name for team in teams], num_sprints)
+    if force:
+        return agg.summarise_sprints(), agg.summarise_bau()
+
+    performance_versions, bau_versions = get_client().get_report_versions(
+        sprint_data['_id'] for _, sprint_data in agg.team_sprints)
+    return (
+        mk_sprint_summaries_df(
+            (team_name, sprint_data)
+            for team_name, sprint_data in agg.team_sprints
+            if is_stale(sprint_data, performance_versions)),
+        mk_bau_summaries_df(
+            (team_name, sprint_data)
+            for team_name, sprint_data in agg.team_sprints
+            if is_stale(sprint_data, bau_versions)))
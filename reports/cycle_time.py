@@ -0,0 +1,99 @@
+from bson import Binary
+from math import ceil, floor
+import numpy as np
+
+
+# Issues taking longer than this quantile of days are left out of
+# forecasts as outliers.
+TRIM_QUANTILE = 0.95
+
+# The sample is packed as little-endian 32 bit integers
+DAYS_TAKEN_DTYPE = '<i4'
+
+
+def mk_cycle_time_stats(days_taken):
+    ''' A team's cycle time statistics, from the days taken by each of its
+        historic issues, ready to be stored.
+
+        Holds the trimmed sample packed in to a binary array, the days
+        taken at each whole percentile 1-99, and the count of issues
+        taking each number of days.
+    '''
+    days = np.array(
+        [days for days in days_taken if days is not None], dtype=int)
+    if len(days):
+        days = days[days < np.quantile(days, TRIM_QUANTILE)]
+    return {
+        'days_taken': Binary(days.astype(DAYS_TAKEN_DTYPE).tobytes()),
+        'count': len(days),
+        'percentiles': (
+            np.percentile(days, np.arange(1, 100)).tolist()
+            if len(days) else []),
+        'histogram': np.bincount(days).tolist(),
+    }
+
+
+def unpack_days_taken(stats):
+    return np.frombuffer(stats['days_taken'], dtype=DAYS_TAKEN_DTYPE)
+
+
+class DaysTakenSketch:
+    ''' The number of issues taking each whole number of days.
+
+        As days taken are whole numbers, counting issues per day is an
+        exact quantile sketch. It is only as big as the longest cycle
+        time, merges by addition, and unlike t-digest or KLL it also
+        supports taking an issue back out when the issue is updated.
+    '''
+    def __init__(self, counts=()):
+        self.counts = np.array(counts, dtype=np.int64)
+
+    @classmethod
+    def from_days_taken(cls, days_taken):
+        return cls(np.bincount(np.array(
+            [days for days in days_taken if days is not None], dtype=int)))
+
+    @classmethod
+    def from_mongo(cls, sketch_data):
+        ''' From a stored {day: count} map '''
+        counts = {
+            int(day): count
+            for day, count in sketch_data.get('counts', {}).items()}
+        sketch = np.zeros(max(counts, default=-1) + 1, dtype=np.int64)
+        sketch[list(counts)] = list(counts.values())
+        return cls(sketch)
+
+    @property
+    def count(self):
+        return int(self.counts.sum())
+
+    def merge(self, other):
+        counts = np.zeros(
+            max(len(self.counts), len(other.counts)), dtype=np.int64)
+        counts[:len(self.counts)] += self.counts
+        counts[:len(other.counts)] += other.counts
+        return DaysTakenSketch(counts)
+
+    __add__ = merge
+
+    def quantile(self, q):
+        ''' Days taken at quantile `q`, interpolated as numpy.quantile
+            does over the full sample.
+        '''
+        total = self.count
+        if not total:
+            raise ValueError('no issues in the sketch')
+        cumulative = np.cumsum(self.counts)
+        rank = q * (total - 1)
+        low, high = np.searchsorted(
+            cumulative, [floor(rank), ceil(rank)], side='right')
+        return low + (rank - floor(rank)) * (high - low)
+
+    def percentile(self, percent):
+        return self.quantile(percent / 100)
+
+    def trimmed(self, quantile=TRIM_QUANTILE):
+        ''' Without the issues at or beyond `quantile` '''
+        if not self.count:
+            return self
+        return DaysTakenSketch(self.counts[:ceil(self.quantile(quantile))])
@@ -1,4 +1,5 @@
 import arrow
+from collections import Counter
 import pandas as pd
 
 from database.mongo import get_client
@@ -13,19 +14,6 @@ def goal_complete(sprint_aux_data):
     return bool(sprint_aux_data.get('goal_completed'))
 
 
-def summarise_sprint(team_name, sprint_data, sprint_aux_data):
-    sprint_summary_df = mk_issues_summary_df(sprint_data).tail(1)
-    sprint_summary_df['start_date'] = sprint_data['start']
-    sprint_summary_df['end_date'] = sprint_data['end']
-    goal_completed = (
-        100 if goal_complete(sprint_aux_data) else 0)
-    sprint_summary_df['goal_completed'] = goal_completed
-    sprint_summary_df['_id'] = sprint_data['_id']
-    sprint_summary_df['team_name'] = team_name
-    sprint_summary_df = sprint_summary_df.drop(columns=['planned'])
-    return sprint_summary_df
-
-
 def mk_issues_summary_df(sprint_data):
     issues_df = pd.DataFrame.from_records(
         sprint_data['issues']
@@ -75,46 +63,131 @@ def _summarise(df):
     return transformed_df
 
 
-def mk_bau_summary_df(team_name, sprint_data):
+SUMMARY_COLUMNS = [
+    'issues_count',
+    'delivered_issues_count',
+    'bau_issues_count',
+    'roadmap_issues_count',
+    'roadmap_delivered_issues_count',
+]
+
+
+def mk_sprint_summaries_df(team_sprints):
+    ''' Summary report rows for many sprints, of many teams, at once.
+
+        `team_sprints` is an iterable of (team_name, sprint_data) pairs,
+        where sprint_data carries its `auxillary_data` lookup.
+        Produces the same rows as the 'Total' row of
+        `mk_issues_summary_df` for each sprint, computed over a single
+        long table of every issue rather than a frame per sprint.
+    '''
+    sprint_records = []
+    issue_records = []
+    for team_name, sprint_data in team_sprints:
+        aux = sprint_data.get('auxillary_data')
+        aux_doc = aux[-1] if aux else {}
+        sprint_records.append((
+            sprint_data['start'],
+            sprint_data['end'],
+            100 if goal_complete(aux_doc) else 0,
+            sprint_data['_id'],
+            team_name,
+            sprint_data.get('version', 0)))
+        issue_records.extend(
+            (sprint_data['_id'], issue['finished_in_sprint'], issue['bau'])
+            for issue in sprint_data['issues'])
+
+    sprints_df = pd.DataFrame.from_records(
+        sprint_records,
+        columns=[
+            'start_date', 'end_date', 'goal_completed', '_id', 'team_name',
+            'sprint_version'])
     issues_df = pd.DataFrame.from_records(
-        sprint_data['issues'])
-    bau_summary = [
+        issue_records, columns=['_id', 'finished_in_sprint', 'bau'])
+    issues_df = issues_df.astype({'finished_in_sprint': bool, 'bau': bool})
+    issues_df['roadmap'] = ~issues_df.bau
+    issues_df['roadmap_delivered'] = (
+        issues_df.roadmap & issues_df.finished_in_sprint)
+
+    counts_df = issues_df.groupby('_id').agg(
+        issues_count=('bau', 'size'),
+        delivered_issues_count=('finished_in_sprint', 'sum'),
+        bau_issues_count=('bau', 'sum'),
+        roadmap_issues_count=('roadmap', 'sum'),
+        roadmap_delivered_issues_count=('roadmap_delivered', 'sum'))
+
+    df = sprints_df.join(counts_df, on='_id')
+    df[SUMMARY_COLUMNS] = df[SUMMARY_COLUMNS].fillna(0).astype(int)
+    df['delivered_issues_percentage'] = percent(
+        df, 'delivered_issues_count', 'issues_count').round()
+    df['bau_issues_percentage'] = percent(
+        df, 'bau_issues_count', 'issues_count').round()
+    df['roadmap_delivered_issues_percentage'] = percent(
+        df, 'roadmap_delivered_issues_count', 'roadmap_issues_count').round()
+    return df[
+        SUMMARY_COLUMNS + [
+            'delivered_issues_percentage',
+            'bau_issues_percentage',
+            'roadmap_delivered_issues_percentage',
+            'start_date',
+            'end_date',
+            'goal_completed',
+            '_id',
+            'team_name',
+            'sprint_version']]
+
+
+def count_bau_labels(issues):
+    return dict(Counter(
         bau_category
-        for row in issues_df[issues_df.bau.eq(True)].bau_breakdown
-        for bau_category in row
-    ]
-    record = {
+        for issue in issues if issue['bau']
+        for bau_category in issue['bau_breakdown']
+    ).most_common())
+
+
+def mk_bau_summary_record(team_name, sprint_data):
+    return {
         '_id': sprint_data['_id'],
         'team_name': team_name,
         'start_date': sprint_data['start'],
         'end_date': sprint_data['end'],
-        'bau_summary': bau_summary}
-    df = pd.DataFrame.from_records([record])
-    return df
+        'bau_summary': count_bau_labels(sprint_data['issues']),
+        'sprint_version': sprint_data.get('version', 0)}
+
+
+def mk_bau_summaries_df(team_sprints):
+    ''' BAU reports, with the issue count for each BAU label '''
+    return pd.DataFrame.from_records([
+        mk_bau_summary_record(team_name, sprint_data)
+        for team_name, sprint_data in team_sprints
+    ])
+
 
+# The Metrics page summarises the last six sprints
+METRICS_NUM_SPRINTS = 6
 
-class SprintsAggregate:
-    def __init__(self, team_name, num_sprints):
+
+def window_start(num_sprints):
+    return arrow.utcnow().shift(
+        weeks=-(num_sprints * 2)).floor('day').datetime
+
+
+class TeamsSprintsAggregate:
+    ''' The sprints of many teams, loaded with a fixed number of
+        queries rather than a few per team.
+    '''
+    def __init__(self, team_names, num_sprints):
         self.db = get_client()
-        self.team_name = team_name
-        self.sprints_data = self.db.get_sprints_and_aux(
-            team_name,
-            arrow.utcnow().shift(weeks=-(num_sprints * 2)).datetime
-        )
+        sprints_by_team = self.db.get_teams_sprints_and_aux(
+            tuple(team_names), window_start(num_sprints))
+        self.team_sprints = [
+            (team_name, sprint_data)
+            for team_name, sprints_data in sprints_by_team.items()
+            for sprint_data in sprints_data
+        ]
 
     def summarise_sprints(self):
-        sprint_summaries = []
-        for sprint_data in self.sprints_data:
-            aux = sprint_data.pop("auxillary_data")
-            aux_doc = aux.pop() if aux else {}
-            sprint_summaries.append(
-                summarise_sprint(self.team_name, sprint_data, aux_doc))
-        return pd.concat(sprint_summaries).reset_index(drop=True)
+        return mk_sprint_summaries_df(self.team_sprints)
 
     def summarise_bau(self):
-        bau_summaries = []
-        for sprint_data in self.sprints_data:
-            sprint_data.pop("auxillary_data")
-            bau_summaries.append(
-                mk_bau_summary_df(self.team_name, sprint_data))
-        return pd.concat(bau_summaries)
+        return mk_bau_summaries_df(self.team_sprints)
@@ -25,7 +25,8 @@ setuptools.setup(
     extras_require={
         'test': [
             'pytest',
-            'lenses'
+            'lenses',
+            'mongomock'
         ],
     }
 )
@@ -171,3 +171,22 @@ def test_not_started_in_sprint(
             days_taken=1),
     )(sprint)
     assert sprint.started_in_sprint(sprint.issues[0]) is False
+
+
+def test_throughput_counts_issues_finished_in_sprint(
+        basic_scenario, base_issues, sprint_issues_lens):
+    raw_json, _ = basic_scenario
+    finished = sprint_issues_lens[0].status_metrics.set(
+        StatusMetrics(
+            started=True,
+            finished=True,
+            start=datetime(
+                2020, 1, 2, 9, 0, 0, tzinfo=timezone(timedelta(hours=1))),
+            end=datetime(
+                2020, 1, 3, 9, 0, 0, tzinfo=timezone(timedelta(hours=1))),
+            days_taken=1),
+    )
+    sprint = Sprint.from_parsed_json(raw_json, lambda x: base_issues * 2)
+    assert sprint.to_mongo()['throughput'] == 0
+    sprint = finished(sprint)
+    assert sprint.to_mongo()['throughput'] == 1
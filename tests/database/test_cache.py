@@ -0,0 +1,90 @@
+import pytest
+
+from database.cache import TTLCache, cached
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+def test_hit_and_miss_statistics(clock):
+    cache = TTLCache(ttl=10, max_size=5, clock=clock)
+    assert cache.get('a') is None
+    cache.set('a', 1)
+    assert cache.get('a') == 1
+    stats = cache.stats()
+    assert stats['hits'] == 1
+    assert stats['misses'] == 1
+    assert stats['hit_rate'] == 0.5
+
+
+def test_entries_expire(clock):
+    cache = TTLCache(ttl=10, max_size=5, clock=clock)
+    cache.set('a', 1)
+    clock.now = 10
+    assert cache.get('a') is None
+    assert cache.stats()['expirations'] == 1
+
+
+def test_least_recently_used_evicted(clock):
+    cache = TTLCache(ttl=10, max_size=2, clock=clock)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+
+
+def test_invalidate_only_tagged_entries(clock):
+    cache = TTLCache(ttl=10, max_size=5, clock=clock)
+    cache.set('a', 1, tags=[('sprint', 1)])
+    cache.set('b', 2, tags=[('sprint', 1), ('team', 'cx')])
+    cache.set('c', 3, tags=[('sprint', 2)])
+    cache.invalidate(('sprint', 1))
+    assert cache.get('a') is None
+    assert cache.get('b') is None
+    assert cache.get('c') == 3
+
+
+def test_zero_ttl_disables_cache(clock):
+    cache = TTLCache(ttl=0, max_size=5, clock=clock)
+    cache.set('a', 1)
+    assert cache.get('a') is None
+
+
+class FakeClient:
+    def __init__(self):
+        self.cache = TTLCache(ttl=10, max_size=5)
+        self.calls = 0
+
+    @cached(lambda team_name, res: [('sprints', team_name)])
+    def get_sprints(self, team_name):
+        self.calls += 1
+        return [{'_id': 1, 'auxillary_data': []}]
+
+
+def test_cached_method_reads_through_once():
+    client = FakeClient()
+    client.get_sprints('cx')
+    client.get_sprints(team_name='cx')
+    assert client.calls == 1
+    client.cache.invalidate(('sprints', 'cx'))
+    client.get_sprints('cx')
+    assert client.calls == 2
+
+
+def test_cached_results_are_isolated_from_callers():
+    client = FakeClient()
+    client.get_sprints('cx')[0].pop('auxillary_data')
+    assert 'auxillary_data' in client.get_sprints('cx')[0]
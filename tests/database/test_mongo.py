@@ -0,0 +1,263 @@
+import importlib
+import os
+from datetime import datetime, timedelta
+
+import mongomock
+import pytest
+from pymongo.errors import BulkWriteError
+from pymongo.read_preferences import Primary, SecondaryPreferred
+
+from database.mongo import (
+    SPRINT_ISSUE_KEYS, Client, DBConfig, mk_read_preference,
+    mk_sprint_issue_docs, strip_sprint_issue_doc)
+from reports.utils import METRICS_NUM_SPRINTS, window_start
+
+
+@pytest.fixture
+def mock_client(monkeypatch):
+    monkeypatch.setattr(DBConfig, 'config', DBConfig.config_class(
+        host='localhost', port=27017, username='', password=''))
+    # Newer pymongo passes bulk write operations a sort, which
+    # mongomock predates
+    for name in ('add_replace', 'add_update'):
+        add = getattr(mongomock.collection.BulkOperationBuilder, name)
+        monkeypatch.setattr(
+            mongomock.collection.BulkOperationBuilder, name,
+            lambda self, *a, sort=None, add=add, **kw: add(self, *a, **kw))
+    client = Client()
+    client._client = mongomock.MongoClient()
+    client._pid = os.getpid()
+    return client
+
+
+def test_primary_ignores_staleness():
+    assert mk_read_preference('primary', -1) == Primary()
+
+
+def test_secondary_preferred_with_staleness():
+    read_preference = mk_read_preference('secondaryPreferred', 120)
+    assert read_preference == SecondaryPreferred(max_staleness=120)
+
+
+def test_unknown_read_preference():
+    with pytest.raises(ValueError):
+        mk_read_preference('tertiary', -1)
+
+
+def test_sprint_issue_docs_round_trip():
+    issues = [{'name': 'EX-2', 'bau': False}, {'name': 'EX-1', 'bau': True}]
+    sprint = {'_id': 7, 'team_id': 'team', 'issues': issues}
+    docs = mk_sprint_issue_docs(sprint)
+    assert docs[0]['_id'] == {'sprint_id': 7, 'name': 'EX-2'}
+    assert [doc['position'] for doc in docs] == [0, 1]
+    assert [strip_sprint_issue_doc(doc) for doc in docs] == issues
+
+
+# mongomock can't run a $lookup with `let`, this one finds the same
+# issues for sprints with few enough of them to be in insertion order.
+MOCK_SPRINT_ISSUES_LOOKUP = [
+    {
+        "$lookup": {
+            "from": "sprint_issues",
+            "localField": "_id",
+            "foreignField": "sprint_id",
+            "as": "sprint_issues"
+        }
+    },
+    {
+        "$addFields": {"issues": {"$ifNull": ["$issues", "$sprint_issues"]}}
+    },
+    {
+        "$project": dict(
+            {"sprint_issues": 0},
+            **{"issues." + key: 0 for key in SPRINT_ISSUE_KEYS})
+    }
+]
+
+
+@pytest.mark.parametrize('normalised', [False, True])
+def test_sprint_issues_page(mock_client, monkeypatch, normalised):
+    monkeypatch.setattr(
+        'database.mongo.SPRINT_ISSUES_LOOKUP', MOCK_SPRINT_ISSUES_LOOKUP)
+    issues = [
+        {'name': 'EX-%d' % i, 'bau': i % 2 == 0} for i in range(5)]
+    sprint = {'_id': 7, 'team_id': 'team', 'issues': issues}
+    db = mock_client.client.sprints
+    if normalised:
+        db.sprints.insert_one({'_id': 7, 'team_id': 'team'})
+        db.sprint_issues.insert_many(mk_sprint_issue_docs(sprint))
+    else:
+        db.sprints.insert_one(sprint)
+
+    page, total = mock_client.get_sprint_issues_page(
+        7, {'bau': True}, [('bau', -1)], skip=1, limit=1)
+    assert total == 3
+    # ties broken by position in the sprint
+    assert [issue['name'] for issue in page] == ['EX-2']
+    assert page[0]['position'] == 2
+
+    page, total = mock_client.get_sprint_issues_page(
+        7, {}, [('bau', 1)], skip=0, limit=10)
+    assert total == 5
+    assert [issue['name'] for issue in page] == [
+        'EX-1', 'EX-3', 'EX-0', 'EX-2', 'EX-4']
+
+    assert mock_client.get_sprint_issues_page(
+        7, {'name': 'none'}, [], skip=0, limit=10) == ([], 0)
+    assert mock_client.get_sprint_issues_page(
+        8, {}, [], skip=0, limit=10) == ([], 0)
+
+
+def test_report_versions_from_a_generator(mock_client):
+    db = mock_client.client.sprints
+    for collection in (db.performance_reports, db.bau_reports):
+        collection.insert_many([
+            {'_id': 1, 'sprint_version': 1},
+            {'_id': 2, 'sprint_version': 2}])
+    assert mock_client.get_report_versions(
+        sprint_id for sprint_id in (1, 2, 3)
+    ) == ({1: 1, 2: 2}, {1: 1, 2: 2})
+
+
+def test_sprint_without_its_issues_is_retried(mock_client, monkeypatch):
+    monkeypatch.setattr(mock_client.conn_info, 'issue_layout', 'normalised')
+    sprint = {'_id': 7, 'name': 'one', 'issues': [{'name': 'EX-1'}]}
+    with monkeypatch.context() as patch:
+        patch.setattr(
+            mock_client, '_add_sprint_issues', lambda db, sprints: {7})
+        assert mock_client.add_sprints({'team': [dict(sprint)]}) == {
+            7: 'failed'}
+    db = mock_client.client.sprints
+    assert db.sprints.count_documents({}) == 0
+
+    assert mock_client.add_sprints({'team': [dict(sprint)]}) == {
+        7: 'created'}
+    assert 'issues' not in db.sprints.find_one({'_id': 7})
+    assert db.sprint_issues.count_documents({'sprint_id': 7}) == 1
+
+
+def test_embedded_sprints_created_then_skipped(mock_client):
+    sprint = {'_id': 7, 'name': 'one', 'issues': [{'name': 'EX-1'}]}
+    assert mock_client.add_sprints({'cx': [dict(sprint)]}) == {
+        7: 'created'}
+    assert mock_client.add_sprints({'cx': [
+        dict(sprint, name='renamed'),
+        {'_id': 8, 'name': 'two', 'issues': []}]}) == {
+            7: 'skipped', 8: 'created'}
+    stored = mock_client.client.sprints.sprints.find_one({'_id': 7})
+    assert (stored['name'], stored['issues'], stored['version']) == (
+        'one', [{'name': 'EX-1'}], 1)
+    assert mock_client.client.sprints.sprint_issues.count_documents(
+        {}) == 0
+
+
+def test_sprints_of_new_and_known_teams(mock_client):
+    db = mock_client.client.sprints
+    cx_id = db.teams.insert_one({'name': 'cx'}).inserted_id
+    assert mock_client.add_sprints({
+        'cx': [{'_id': 7, 'issues': []}],
+        'ds': [{'_id': 8, 'issues': []}]}) == {
+            7: 'created', 8: 'created'}
+    assert db.teams.count_documents({}) == 2
+    ds_id = db.teams.find_one({'name': 'ds'})['_id']
+    assert db.sprints.find_one({'_id': 7})['team_id'] == cx_id
+    assert db.sprints.find_one({'_id': 8})['team_id'] == ds_id
+    assert mock_client.resolve_team_ids(['ds', 'cx']) == {
+        'cx': cx_id, 'ds': ds_id}
+
+
+def test_sprints_failing_to_write(mock_client, monkeypatch):
+    def bulk_write(self, requests, ordered=True):
+        # the first sprint is written, the second refused
+        raise BulkWriteError({
+            'writeErrors': [{'index': 1, 'errmsg': 'refused'}],
+            'upserted': [{'index': 0, '_id': 7}]})
+    monkeypatch.setattr(
+        mongomock.collection.Collection, 'bulk_write', bulk_write)
+    assert mock_client.add_sprints({'cx': [
+        {'_id': 7, 'issues': []}, {'_id': 8, 'issues': []}]}) == {
+            7: 'created', 8: 'failed'}
+
+
+def test_normalise_sprint_issues(mock_client):
+    db = mock_client.client.sprints
+    db.sprints.insert_many([
+        {'_id': 7, 'team_id': 'team', 'issues': [{'name': 'EX-1'}]},
+        {'_id': 8, 'team_id': 'team'}])
+    assert mock_client.normalise_sprint_issues() == (1, 0)
+    assert 'issues' not in db.sprints.find_one({'_id': 7})
+    assert strip_sprint_issue_doc(db.sprint_issues.find_one()) == {
+        'name': 'EX-1'}
+
+
+def test_historic_days_taken_of_all_stored_issues(mock_client):
+    db = mock_client.client.sprints
+    team_id = db.teams.insert_one({'name': 'cx'}).inserted_id
+    db.historic_issues.insert_many([
+        {'name': 'EX-1', 'team_id': team_id, 'days_taken': 3},
+        {'name': 'EX-2', 'team_id': team_id, 'days_taken': None},
+        {'name': 'EX-3', 'team_id': 'other', 'days_taken': 5}])
+    mock_client.add_historic_issues(
+        'cx', [{'name': 'EX-4', 'days_taken': 1}])
+    assert sorted(mock_client.get_historic_days_taken('cx')) == [1, 3]
+
+
+def test_days_taken_sketch_built_when_missing(mock_client):
+    db = mock_client.client.sprints
+    team_id = db.teams.insert_one({'name': 'cx'}).inserted_id
+    db.historic_issues.insert_many([
+        {'name': 'EX-1', 'team_id': team_id, 'days_taken': 3},
+        {'name': 'EX-2', 'team_id': team_id, 'days_taken': 3}])
+    # replacing an issue no sketch has counted yet
+    mock_client.add_historic_issues(
+        'cx', [{'name': 'EX-1', 'days_taken': 1}])
+    sketch = db.days_taken_sketches.find_one({'_id': team_id})
+    assert sketch['counts'] == {'1': 1, '3': 1}
+    mock_client.add_historic_issues(
+        'cx', [{'name': 'EX-2', 'days_taken': 1}])
+    sketch = db.days_taken_sketches.find_one({'_id': team_id})
+    assert {
+        days: count for days, count in sketch['counts'].items() if count
+    } == {'1': 2}
+
+
+def test_auxillary_saves_from_two_processes(mock_client):
+    # Another worker, sharing the database but not the cache
+    other = Client()
+    other._client = mock_client._client
+    other._pid = mock_client._pid
+    assert mock_client.get_sprint_auxillary_data(7) == {}
+
+    other.update_sprint_auxillary_data(7, {'notes': 'notes'})
+    other.update_sprint_auxillary_data(7, {'goal_completed': True})
+    assert mock_client.get_sprint_auxillary_data(7)['goal_completed']
+    mock_client.update_sprint_auxillary_data(7, {'goal_completed': False})
+    aux = other.get_sprint_auxillary_data(7)
+    assert (aux['notes'], aux['goal_completed']) == ('notes', False)
+
+
+def test_bau_label_counts_migration_totals(mock_client):
+    migration = importlib.import_module(
+        'database.migrations.20261019130000_bau_label_counts')
+    db = mock_client.client.sprints
+    recent = datetime.utcnow() - timedelta(weeks=1)
+    db.bau_reports.insert_many([
+        {'_id': 1, 'team_name': 'cx', 'end_date': recent,
+         'bau_summary': ['bug', 'bug', 'ops']},
+        {'_id': 2, 'team_name': 'cx', 'end_date': recent,
+         'bau_summary': ['ops']},
+        {'_id': 3, 'team_name': 'ds', 'end_date': recent,
+         'bau_summary': []},
+        {'_id': 4, 'team_name': 'ds', 'end_date': recent - timedelta(
+            weeks=52), 'bau_summary': ['bug']}])
+    migration.upgrade(db)
+    migrated = {
+        totals['_id']: totals['bau_summary']
+        for totals in db.bau_totals.find()}
+    assert migrated == {'cx': {'bug': 2, 'ops': 2}, 'ds': {}}
+
+    mock_client.refresh_bau_totals(
+        ['cx', 'ds'], window_start(METRICS_NUM_SPRINTS))
+    assert migrated == {
+        totals['_id']: totals['bau_summary']
+        for totals in db.bau_totals.find()}
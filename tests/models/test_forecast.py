@@ -0,0 +1,247 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+from config import config
+from database.cache import TTLCache
+from database.mongo import DBConfig
+from models.forecast import (
+    MAX_ISSUES, THROUGHPUT, CycleTimeDistribution, Forecast, MonteCarloResult,
+    NotEnoughHistory, PortfolioForecast, TeamSimulation, get_forecast_state,
+    mk_throughput_df, simulate_days_taken, simulate_portfolio,
+    simulate_sprints_taken, simulate_throughput_paths, clamp_issues,
+    _init_simulation_process)
+
+
+def test_constant_pool_sums_exactly():
+    totals = simulate_days_taken([3], num_issues=7, simulations=50)
+    assert (totals == 21).all()
+    assert len(totals) == 50
+
+
+def test_seeded_simulations_repeat():
+    pool = [1, 2, 3, 5, 8]
+    a = simulate_days_taken(pool, 30, rng=np.random.default_rng(1))
+    b = simulate_days_taken(pool, 30, rng=np.random.default_rng(1))
+    assert (a == b).all()
+
+
+def test_simulations_split_in_to_blocks(monkeypatch):
+    monkeypatch.setattr('models.forecast.MAX_BLOCK_SAMPLES', 10)
+    totals = simulate_days_taken([1, 2], num_issues=4, simulations=25)
+    assert len(totals) == 25
+    assert ((totals >= 4) & (totals <= 8)).all()
+
+
+def test_result_percentiles():
+    result = MonteCarloResult.from_totals(np.arange(100, 0, -1))
+    assert result.days_taken[0] == 1
+    assert result.percentiles[50] == 50.5
+
+
+def test_distribution_of_two_issues():
+    # sums of two draws from {1, 2}: 2 (25%), 3 (50%), 4 (25%)
+    dist = CycleTimeDistribution([1, 2], max_issues=2)
+    assert dist.percentile(1, 50) == 1
+    assert dist.percentile(2, 25) == 2
+    assert dist.percentile(2, 50) == 3
+    assert dist.percentile(2, 99) == 4
+
+
+def test_distribution_agrees_with_simulation():
+    pool = np.random.default_rng(0).integers(0, 20, 500)
+    dist = CycleTimeDistribution(pool, max_issues=50)
+    totals = simulate_days_taken(
+        pool, 50, simulations=20000, rng=np.random.default_rng(1))
+    for percent in (50, 80):
+        expected = np.percentile(totals, percent)
+        assert abs(dist.percentile(50, percent) - expected) <= 3
+
+
+def test_distribution_curve_is_increasing():
+    dist = CycleTimeDistribution([0, 1, 5, 9], max_issues=30)
+    curve = dist.percentile_curve(80)
+    assert len(curve) == 30
+    assert (np.diff(curve) >= 0).all()
+
+
+def test_cumulative_throughput_oldest_first():
+    sprints = [
+        {'name': 'c', 'end': datetime(2020, 1, 29), 'throughput': 4},
+        {'name': 'b', 'end': datetime(2020, 1, 15), 'throughput': 2},
+        {'name': 'a', 'end': datetime(2020, 1, 1), 'throughput': 3},
+    ]
+    df = mk_throughput_df(sprints)
+    assert df['name'].tolist() == ['a', 'b', 'c']
+    assert df['throughput'].tolist() == [3, 5, 9]
+    assert Forecast.minmax_gradients(df) == (2 / 14, 6 / 28)
+
+
+class FakeConnInfo:
+    persist_forecasts = True
+
+
+class FakeClient:
+    def __init__(self):
+        self.cache = TTLCache(ttl=10, max_size=5)
+        self.conn_info = FakeConnInfo()
+        self.results = {}
+        self.version = (1,)
+        self.loads = 0
+
+    def get_forecast_data_version(self, team_name, ending_after):
+        return self.version
+
+    def get_sprint_throughputs(self, team_name, ending_after):
+        self.loads += 1
+        return [
+            {'name': 'b', 'start': datetime(2020, 1, 1),
+             'end': datetime(2020, 1, 15), 'throughput': 2},
+            {'name': 'a', 'start': datetime(2019, 12, 18),
+             'end': datetime(2020, 1, 1), 'throughput': 3},
+        ]
+
+    def get_cycle_time_stats(self, team_name):
+        return None
+
+    def get_days_taken_sketches(self, team_names):
+        return []
+
+    def get_historic_issues(self, team_name):
+        return [{'days_taken': days} for days in range(20)]
+
+    def get_forecast_result(self, result_id):
+        return self.results.get(result_id)
+
+    def put_forecast_result(self, result_id, result):
+        self.results[result_id] = result
+
+
+@pytest.fixture
+def fake_client(monkeypatch):
+    client = FakeClient()
+    monkeypatch.setattr('models.forecast.get_client', lambda: client)
+    monkeypatch.setattr('models.forecast._forecast_states', {})
+    monkeypatch.setattr(
+        'models.forecast._forecast_results', TTLCache(ttl=10, max_size=5))
+    return client
+
+
+def test_forecast_state_rebuilt_only_for_new_data(fake_client):
+    state = get_forecast_state('cx')
+    assert get_forecast_state('cx') is state
+    assert fake_client.loads == 1
+    assert state.days_taken_pool.max() < 19
+    assert state.sprint_days == 14
+    assert state.sketch.percentile(50) == np.percentile(range(19), 50)
+    fake_client.version = (2,)
+    assert get_forecast_state('cx') is not state
+    assert fake_client.loads == 2
+
+
+def test_sprints_taken_at_constant_throughput():
+    sprints = simulate_sprints_taken([4], num_issues=10, simulations=20)
+    assert (sprints == 3).all()
+
+
+def test_throughput_paths_reach_every_issue():
+    paths = simulate_throughput_paths(
+        [0, 1, 2], num_issues=40, simulations=200,
+        rng=np.random.default_rng(2))
+    assert (paths[:, -1] >= 40).all()
+    assert (np.diff(paths, axis=1) >= 0).all()
+
+
+def test_portfolio_finishes_with_the_slowest_team():
+    teams = {
+        'fast': TeamSimulation(pool=np.array([1]), num_issues=5),
+        'slow': TeamSimulation(pool=np.array([2, 3]), num_issues=5),
+    }
+    result = simulate_portfolio(teams, simulations=100, seed=3)
+    assert result.teams['fast'].percentiles[50] == 5
+    assert (result.joint.days_taken >= 10).all()
+    with ThreadPoolExecutor() as executor:
+        pooled = simulate_portfolio(
+            teams, simulations=100, seed=3, executor=executor)
+    assert (pooled.joint.days_taken == result.joint.days_taken).all()
+
+
+def test_forecast_results_are_seeded_and_persisted(
+        fake_client, monkeypatch):
+    curves = Forecast('cx').confidence_curves(30, mode=THROUGHPUT)
+    assert len(fake_client.results) == 1
+    monkeypatch.setattr(
+        'models.forecast._forecast_results', TTLCache(ttl=10, max_size=5))
+    stored = Forecast('cx').confidence_curves(30, mode=THROUGHPUT)
+    assert (stored[80] == curves[80]).all()
+    fake_client.results.clear()
+    monkeypatch.setattr(
+        'models.forecast._forecast_results', TTLCache(ttl=10, max_size=5))
+    rerun = Forecast('cx').confidence_curves(30, mode=THROUGHPUT)
+    assert (rerun[80] == curves[80]).all()
+
+
+def test_not_enough_history_to_forecast(fake_client, monkeypatch):
+    monkeypatch.setattr(
+        fake_client, 'get_sprint_throughputs',
+        lambda team_name, ending_after: [
+            {'name': 'a', 'start': datetime(2020, 1, 1),
+             'end': datetime(2020, 1, 15), 'throughput': 0}])
+    forecast = Forecast('cx')
+    with pytest.raises(NotEnoughHistory):
+        forecast.confidence_curves(10, mode=THROUGHPUT)
+    with pytest.raises(NotEnoughHistory):
+        forecast.uncertainty_cone_coords(10)
+
+
+def test_uncertainty_cone_to_the_remaining_issues(fake_client):
+    quick, slow = Forecast('cx').uncertainty_cone_coords(10)
+    # 3 issues, then 2 more 14 days later: 12 more at 1 every 7 days
+    assert quick == slow == (
+        datetime(2020, 1, 1), 3, datetime(2020, 3, 25), 15)
+
+
+def test_remaining_issues_clamped():
+    assert clamp_issues(None) is None
+    assert clamp_issues(-3) == 0
+    assert clamp_issues(12.0) == 12
+    assert clamp_issues(10 ** 6) == MAX_ISSUES
+    assert clamp_issues('many') is None
+
+
+def test_portfolio_forecasts_are_seeded(fake_client, monkeypatch):
+    monkeypatch.setattr('models.forecast.get_executor', lambda: None)
+    result = PortfolioForecast({'cx': 20}).forecast()
+    assert PortfolioForecast({'cx': 20}).forecast() is result
+    monkeypatch.setattr(
+        'models.forecast._forecast_results', TTLCache(ttl=10, max_size=5))
+    rerun = PortfolioForecast({'cx': 20}).forecast()
+    assert (rerun.joint.days_taken == result.joint.days_taken).all()
+
+
+def test_simulation_process_config_set_once(monkeypatch):
+    monkeypatch.setattr(DBConfig, 'config', None)
+    db_config = {
+        'host': 'db', 'port': 27017, 'username': 'u', 'password': 'p'}
+    _init_simulation_process(db_config)
+    assert config.get('db').host == 'db'
+    # as when re-importing __main__ already set it
+    _init_simulation_process(dict(db_config, host='other'))
+    assert config.get('db').host == 'db'
+
+
+def test_portfolio_without_history(fake_client, monkeypatch):
+    monkeypatch.setattr(
+        fake_client, 'get_historic_issues', lambda team_name: [])
+    with pytest.raises(NotEnoughHistory):
+        PortfolioForecast({'cx': 5}).forecast()
+
+
+def test_small_portfolios_run_serially(fake_client, monkeypatch):
+    def get_executor():
+        raise AssertionError('small forecasts need no pool')
+    monkeypatch.setattr('models.forecast.get_executor', get_executor)
+    monkeypatch.setattr('models.forecast.simulation_pool_size', lambda: 4)
+    PortfolioForecast({'cx': 5}).forecast()
@@ -0,0 +1,100 @@
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from models.forecast_jobs import (
+    DONE, FAILED, RUNNING, submit_forecast_job)
+
+
+class FakeClient:
+    def __init__(self):
+        self.jobs = {}
+
+    def start_forecast_job(self, job_id, job):
+        existing = self.jobs.get(job_id)
+        if existing is None:
+            self.jobs[job_id] = dict(
+                job, _id=job_id, updated=datetime.utcnow())
+        return existing
+
+    def restart_forecast_job(self, job_id, last_updated, job):
+        self.jobs[job_id].update(job, updated=datetime.utcnow())
+        return True
+
+    def update_forecast_job(self, job_id, **fields):
+        self.jobs[job_id].update(fields, updated=datetime.utcnow())
+
+    def get_forecast_job(self, job_id):
+        return self.jobs[job_id]
+
+
+class InlineExecutor:
+    def __init__(self):
+        self.submitted = 0
+        self.broken = False
+
+    def submit(self, fn, *args):
+        self.submitted += 1
+        future = Future()
+        if self.broken:
+            future.set_exception(BrokenProcessPool('pool died'))
+        else:
+            future.set_result(fn(*args))
+        return future
+
+
+class FakeState:
+    version = (1, ())
+    sprint_days = 14
+
+
+class FakeForecast:
+    team_name = 'cx'
+    state = FakeState()
+
+    def montecarlo_pool(self, mode):
+        return np.array([2])
+
+
+@pytest.fixture
+def executor(monkeypatch):
+    client = FakeClient()
+    executor = InlineExecutor()
+    monkeypatch.setattr('models.forecast_jobs.get_client', lambda: client)
+    monkeypatch.setattr('models.forecast_jobs.get_executor', lambda: executor)
+    executor.client = client
+    return executor
+
+
+def test_identical_jobs_run_once(executor):
+    job = submit_forecast_job(FakeForecast(), 5, simulations=2500)
+    assert job['status'] == RUNNING
+    finished = executor.client.get_forecast_job(job['_id'])
+    assert finished['status'] == DONE
+    assert finished['progress'] == 1
+    assert finished['percentiles']['50'] == 10
+    assert finished['histogram'] == {'days': [10], 'counts': [2500]}
+    assert submit_forecast_job(FakeForecast(), 5, simulations=2500) is finished
+    assert executor.submitted == 1
+
+
+def test_abandoned_jobs_restart(executor):
+    job = submit_forecast_job(FakeForecast(), 5, simulations=10)
+    executor.client.jobs[job['_id']].update(
+        status=RUNNING, updated=datetime.utcnow() - timedelta(hours=1))
+    submit_forecast_job(FakeForecast(), 5, simulations=10)
+    assert executor.submitted == 2
+
+
+def test_pool_failures_fail_the_job(executor, monkeypatch):
+    resets = []
+    monkeypatch.setattr('models.forecast_jobs.reset_executor', resets.append)
+    executor.broken = True
+    job = submit_forecast_job(FakeForecast(), 5, simulations=10)
+    failed = executor.client.get_forecast_job(job['_id'])
+    assert failed['status'] == FAILED
+    assert failed['error'] == 'pool died'
+    assert resets == [executor]
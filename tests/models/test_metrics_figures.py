@@ -0,0 +1,35 @@
+import json
+
+import pandas as pd
+import pytest
+
+from models.metrics_figures import TeamMetricsFigures
+
+
+class FakeTeamMetrics:
+    def __init__(self, team_name, version, reports):
+        self.bau_summary = {'ops': 2, 'bug': 1}
+        self.reports = reports
+
+    def sprint_performance_report_df(self):
+        return pd.DataFrame.from_records(self.reports)
+
+
+@pytest.mark.parametrize('reports', [[], [
+    {'start_date': '2026-10-05', 'end_date': '2026-10-19',
+     'bau_issues_percentage': 20,
+     'roadmap_delivered_issues_percentage': 70, 'goal_completed': 100},
+    {'start_date': '2026-09-21', 'end_date': '2026-10-05',
+     'bau_issues_percentage': 40,
+     'roadmap_delivered_issues_percentage': 50, 'goal_completed': 0}]])
+def test_team_metrics_figures(monkeypatch, reports):
+    monkeypatch.setattr(
+        'models.metrics_figures.TeamMetrics',
+        lambda team_name, version: FakeTeamMetrics(
+            team_name, version, reports))
+    figures = {
+        name: json.loads(figure)
+        for name, figure in TeamMetricsFigures('cx').mk_figures(1).items()}
+    assert figures['bau']['data'][0]['labels'] == ['ops', 'bug']
+    # the delivery lines and goal bar, and the goal completion gauge
+    assert len(figures['delivery']['data']) == (4 if reports else 0)
@@ -0,0 +1,118 @@
+import pytest
+
+from models.sprint import (
+    MetricsFigures, SprintAuxillary, mk_issues_match, mk_issues_sort,
+    split_filter_part)
+
+
+class FakeClient:
+    def __init__(self):
+        self.aux = {'goal_completed': False, 'notes': 'notes'}
+        self.reads = 0
+        self.reports = []
+
+    def get_sprint_auxillary_data(self, sprint_id):
+        self.reads += 1
+        return dict(self.aux)
+
+    def update_sprint_auxillary_data(self, sprint_id, data):
+        self.aux.update(data)
+
+    def update_performance_report(self, sprint_id, data):
+        self.reports.append(data)
+
+
+@pytest.fixture
+def fake_client(monkeypatch):
+    client = FakeClient()
+    monkeypatch.setattr('models.sprint.get_client', lambda: client)
+    return client
+
+
+def test_goal_completion_saved_without_reading_back(fake_client):
+    auxillary = SprintAuxillary(1)
+    auxillary.update_goal_completion(True)
+    assert auxillary.goal_completed
+    assert fake_client.aux == {'goal_completed': True, 'notes': 'notes'}
+    assert fake_client.reports == [{'goal_completed': 100}]
+    assert fake_client.reads == 1
+
+
+def test_unchanged_goal_completion_not_saved(fake_client):
+    SprintAuxillary(1).update_goal_completion(False)
+    assert fake_client.reports == []
+
+
+def test_details_filter_query_to_mongo():
+    assert mk_issues_match(
+        '{name} contains "AB.C" && {delivered} = true && '
+        '{planned} contains false'
+    ) == {
+        'name': {'$regex': r'AB\.C', '$options': 'i'},
+        'finished_in_sprint': True,
+        'planned': False,
+    }
+    assert mk_issues_match('{unknown} = 1') == {}
+
+
+def test_details_search_text_is_not_an_operator():
+    assert mk_issues_match('{description} contains "change log"') == {
+        'description': {'$regex': 'change\\ log', '$options': 'i'}}
+    assert mk_issues_match('{description} contains phone app') == {
+        'description': {'$regex': 'phone\\ app', '$options': 'i'}}
+    assert mk_issues_match('{name} contains 123') == {
+        'name': {'$regex': '123', '$options': 'i'}}
+    assert mk_issues_match('{description} contains "a<=b"') == {
+        'description': {'$regex': 'a<=b', '$options': 'i'}}
+
+
+def test_details_comparisons_to_mongo():
+    assert split_filter_part('{name} >= 3') == ('name', 'ge', 3.0)
+    assert split_filter_part('{name} ne "x"') == ('name', 'ne', 'x')
+    assert split_filter_part('{name} 3') == (None, None, None)
+
+
+def test_details_sort_to_mongo():
+    assert mk_issues_sort([
+        {'column_id': 'delivered', 'direction': 'desc'},
+        {'column_id': 'name', 'direction': 'asc'},
+    ]) == [('finished_in_sprint', -1), ('name', 1)]
+
+
+class FakeFiguresClient:
+    def __init__(self):
+        self.version = 1
+        self.stored = {}
+
+    def get_reports_version(self):
+        return self.version
+
+    def get_metrics_figures(self, team_name, version):
+        return self.stored.get((team_name, version))
+
+    def put_metrics_figures(self, team_name, version, figures):
+        self.stored[(team_name, version)] = figures
+
+
+def test_metrics_figures_redrawn_for_new_reports(monkeypatch):
+    client = FakeFiguresClient()
+    monkeypatch.setattr('models.sprint.get_client', lambda: client)
+    draws = []
+
+    def draw(team_name):
+        def draw_team(version):
+            assert version == client.version
+            draws.append((team_name, version))
+            return {'bau': '{"data": []}'}
+        return draw_team
+
+    cache = MetricsFigures()
+    assert cache.get('cx', draw('cx')) == {'bau': {'data': []}}
+    cache.get('cx', draw('cx'))
+    # another process finds the figures already drawn
+    MetricsFigures().get('cx', draw('cx'))
+    assert draws == [('cx', 1)]
+    cache.get('data', draw('data'))
+    client.version = 2
+    cache.get('cx', draw('cx'))
+    assert draws == [('cx', 1), ('data', 1), ('cx', 2)]
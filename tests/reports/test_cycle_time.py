@@ -0,0 +1,34 @@
+import numpy as np
+
+from reports.cycle_time import (
+    DaysTakenSketch, mk_cycle_time_stats, unpack_days_taken)
+
+
+def test_stats_trim_outliers_and_round_trip():
+    stats = mk_cycle_time_stats([None] + list(range(100)))
+    days_taken = unpack_days_taken(stats)
+    assert days_taken.tolist() == list(range(95))
+    assert stats['count'] == 95
+    assert stats['percentiles'][49] == np.percentile(days_taken, 50)
+    assert stats['histogram'] == [1] * 95
+
+
+def test_stats_without_issues():
+    stats = mk_cycle_time_stats([None])
+    assert stats['count'] == 0
+    assert len(unpack_days_taken(stats)) == 0
+    assert stats['percentiles'] == []
+
+
+def test_sketch_quantiles_match_numpy():
+    days_taken = np.random.default_rng(0).integers(0, 40, 250)
+    sketch = DaysTakenSketch.from_days_taken(days_taken.tolist())
+    for q in (0, 0.3, 0.5, 0.8, 1):
+        assert sketch.quantile(q) == np.quantile(days_taken, q)
+
+
+def test_sketches_merge_and_load_from_mongo():
+    a = DaysTakenSketch.from_mongo({'counts': {'1': 2, '3': 1}})
+    b = DaysTakenSketch.from_days_taken([0, 5, None])
+    assert (a + b).counts.tolist() == [1, 2, 0, 1, 0, 1]
+    assert (a + b).percentile(50) == 1
@@ -0,0 +1,92 @@
+from datetime import datetime, timedelta
+from itertools import product
+import random
+
+import pandas as pd
+import pytest
+
+from reports.utils import (
+    count_bau_labels, mk_issues_summary_df, mk_sprint_summaries_df)
+
+
+def mk_sprint(sprint_id, issues, goal_completed=False):
+    start = datetime(2020, 1, 1) + timedelta(weeks=2 * sprint_id)
+    return {
+        '_id': sprint_id,
+        'start': start,
+        'end': start + timedelta(weeks=2),
+        'issues': issues,
+        'auxillary_data': [{'goal_completed': goal_completed}]
+    }
+
+
+def mk_issue(planned, finished_in_sprint, bau):
+    return {
+        'planned': planned,
+        'finished_in_sprint': finished_in_sprint,
+        'bau': bau
+    }
+
+
+def per_sprint_summary(team_name, sprint_data):
+    # The Total row of the per sprint summary, as the reports were
+    # previously built.
+    df = mk_issues_summary_df(sprint_data).tail(1)
+    df['start_date'] = sprint_data['start']
+    df['end_date'] = sprint_data['end']
+    df['goal_completed'] = (
+        100 if sprint_data['auxillary_data'][0]['goal_completed'] else 0)
+    df['_id'] = sprint_data['_id']
+    df['team_name'] = team_name
+    return df.drop(columns=['planned'])
+
+
+@pytest.fixture
+def team_sprints():
+    rng = random.Random(4)
+    flags = list(product([True, False], repeat=3))
+    sprints = [
+        ('cx', mk_sprint(1, [mk_issue(*f) for f in flags])),
+        ('cx', mk_sprint(2, [mk_issue(True, True, False)] * 3)),
+        ('dar', mk_sprint(3, [mk_issue(False, False, True)], True)),
+    ]
+    for sprint_id in range(4, 20):
+        sprints.append((
+            rng.choice(['cx', 'dar']),
+            mk_sprint(
+                sprint_id,
+                [mk_issue(*rng.choice(flags))
+                 for _ in range(rng.randint(1, 30))],
+                rng.random() > 0.5)))
+    return sprints
+
+
+def test_matches_per_sprint_summaries(team_sprints):
+    expected = pd.concat([
+        per_sprint_summary(team_name, sprint_data)
+        for team_name, sprint_data in team_sprints
+    ]).reset_index(drop=True)
+    result = mk_sprint_summaries_df(team_sprints).drop(
+        columns=['sprint_version'])
+    assert list(result.columns) == list(expected.columns)
+    pd.testing.assert_frame_equal(
+        result, expected, check_dtype=False)
+
+
+def test_sprint_without_issues_is_summarised():
+    result = mk_sprint_summaries_df([('cx', mk_sprint(1, []))])
+    assert result.loc[0, 'issues_count'] == 0
+    assert result.loc[0, 'team_name'] == 'cx'
+
+
+def test_no_sprints_to_summarise():
+    assert mk_sprint_summaries_df([]).empty
+
+
+def test_bau_labels_counted():
+    issues = [
+        {'bau': True, 'bau_breakdown': ['support', 'incident']},
+        {'bau': True, 'bau_breakdown': ['support']},
+        {'bau': False, 'bau_breakdown': ['support']},
+    ]
+    assert count_bau_labels(issues) == {'support': 2, 'incident': 1}
@@ -1,5 +1,5 @@
 from .sprints import (
-    Metrics,
-    Sprint, Sprints)
+    Metrics, TeamMetrics,
+    Sprint, SprintNotes, Sprints)
 
-from .forecasts import Forecast
\ No newline at end of file
+from .forecasts import Forecast, PortfolioForecast
@@ -1,17 +1,26 @@
 import dash_html_components as html
 import dash_bootstrap_components as dbc
 import dash_core_components as dcc
+import numpy as np
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 
-from models import Forecast as ForecastModel
+from models import (
+    Forecast as ForecastModel,
+    PortfolioForecast as PortfolioForecastModel)
+from models.forecast import (
+    CYCLE_TIME, MAX_ISSUES, MODES, PERCENTILES, NotEnoughHistory,
+    clamp_issues)
+from models.forecast_jobs import (
+    FAILED, JOB_SIMULATIONS, RUNNING, get_forecast_job, submit_forecast_job)
 
 
 class Forecast:
-    def __init__(self, team_name, remaining_issues=None):
+    def __init__(self, team_name, remaining_issues=None, mode=CYCLE_TIME):
         self.model = ForecastModel(team_name)
-        self.remaining_issues = remaining_issues
+        self.remaining_issues = clamp_issues(remaining_issues)
+        self.mode = mode if mode in MODES else CYCLE_TIME
 
     def mk_throughput_line(self):
         df = self.model.throughput_df()
@@ -25,9 +34,8 @@ class Forecast:
         return fig
 
     def add_uncertaintity_cone(self, throughput_df, fig):
-        current_throughput = throughput_df.iloc[-1]['throughput']
-        target = current_throughput + self.remaining_issues
-        quick, slow = self.model.uncertainty_cone_coords(target)
+        quick, slow = self.model.uncertainty_cone_coords(
+            self.remaining_issues)
 
         x_a, y_a, x_b, y_b = quick
         fig.add_trace(go.Scatter(
@@ -86,8 +94,8 @@ class Forecast:
             self.model.historic_df, x="story_points", y="days_taken")
 
     def mk_time_per_issue_scatter(self):
-        percent_80 = self.model.historic_df['days_taken'].quantile(0.8)
-        percent_50 = self.model.historic_df['days_taken'].quantile(0.5)
+        percent_80 = self.model.percentile(80)
+        percent_50 = self.model.percentile(50)
         issue_min = self.model.historic_df['end_time'].min(numeric_only=False)
         issue_max = self.model.historic_df['end_time'].max(numeric_only=False)
 
@@ -111,56 +119,122 @@ class Forecast:
             fig.add_trace(trace)
         return fig
 
-    def mk_montecarlo_plot(self, num_issues=5):
-        df = self.model.run_montecarlo(num_issues)
-        percent_80 = df['days_taken'].quantile(0.8)
-        percent_70 = df['days_taken'].quantile(0.7)
-        percent_60 = df['days_taken'].quantile(0.6)
-        percent_50 = df['days_taken'].quantile(0.5)
-        issue_min = df['simulation'].min(numeric_only=False)
-        issue_max = df['simulation'].max(numeric_only=False)
-        quantiles_df = pd.DataFrame({
-            'x': [
-                issue_min, issue_max,
-                issue_min, issue_max,
-                issue_min, issue_max,
-                issue_min, issue_max
-                ],
-            'y': [
-                percent_50, percent_50,
-                percent_60, percent_60,
-                percent_70, percent_70,
-                percent_80, percent_80
-            ],
-            'name': [
-                f"50% {round(percent_50)} days",
-                f"50% {round(percent_50)} days",
-                f"60% {round(percent_60)} days",
-                f"60% {round(percent_60)} days",
-                f"70% {round(percent_70)} days",
-                f"70% {round(percent_70)} days",
-                f"80% {round(percent_80)} days",
-                f"80% {round(percent_80)} days"]
-        })
+    def mk_confidence_chart(self, max_issues=100):
+        ''' Days to deliver any number of issues, at each confidence
+            level, in the selected forecasting mode.
+        '''
+        max_issues = min(
+            max(max_issues, self.remaining_issues or 0), MAX_ISSUES)
+        curves = self.model.confidence_curves(max_issues, mode=self.mode)
+        issues = np.arange(1, max_issues + 1)
+        fig = go.Figure()
+        for colour, percent in zip(
+                px.colors.qualitative.Vivid, PERCENTILES):
+            fig.add_trace(go.Scatter(
+                x=issues,
+                y=curves[percent],
+                name=f'{percent}%',
+                mode='lines',
+                line={'color': colour}))
+        if self.remaining_issues:
+            days = [
+                int(curves[percent][self.remaining_issues - 1])
+                for percent in PERCENTILES]
+            fig.add_trace(go.Scatter(
+                x=[self.remaining_issues] * len(days),
+                y=days,
+                text=[
+                    f'{percent}% {day} days'
+                    for percent, day in zip(PERCENTILES, days)],
+                name='remaining issues',
+                mode='markers'))
+        fig.update_layout(
+            xaxis_title='issues',
+            yaxis_title='days')
+        return fig
 
-        fig = px.bar(df, x=df.index, y='days_taken')
-        for trace in px.line(
-                quantiles_df, x='x', y='y', color='name',
-                color_discrete_sequence=px.colors.qualitative.Vivid).data:
-            fig.add_trace(trace)
+    @staticmethod
+    def mk_job_histogram(job):
+        fig = go.Figure(data=go.Bar(
+            x=job['histogram']['days'],
+            y=job['histogram']['counts'],
+            name='simulations'))
+        for colour, (percent, days) in zip(
+                px.colors.qualitative.Vivid, job['percentiles'].items()):
+            fig.add_vline(
+                x=days, line_dash='dash', line_color=colour,
+                annotation_text=f'{percent}% {round(days)} days')
+        fig.update_layout(
+            xaxis_title='days',
+            yaxis_title='simulations')
         return fig
 
+    @classmethod
+    def render_job(cls, job):
+        if job is None:
+            return []
+        if job['status'] == FAILED:
+            return [html.P(f"The forecast failed: {job.get('error')}")]
+        if job['status'] == RUNNING:
+            return [
+                html.P(f"Running {job['simulations']} simulations"),
+                dbc.Progress(value=round(job['progress'] * 100))]
+        return [dcc.Graph(
+            id='montecarlo',
+            figure=cls.mk_job_histogram(job))]
+
+    @classmethod
+    def poll_job(cls, job_id):
+        ''' The job's current rendering, and whether to stop polling '''
+        job = get_forecast_job(job_id) if job_id else None
+        return cls.render_job(job), job is None or job['status'] != RUNNING
+
+    def submit_job(self):
+        ''' The id of the simulations job for the remaining issues,
+            started unless an identical one already exists.
+        '''
+        if not self.remaining_issues:
+            return None
+        return submit_forecast_job(
+            self.model, self.remaining_issues, self.mode)['_id']
+
+    @staticmethod
+    def render_job_controls():
+        # Jobs are only started on request, not as the inputs change
+        return [
+            dbc.Button(
+                f'Run {JOB_SIMULATIONS} simulations',
+                id='forecast-run', color='primary'),
+            html.Div(id='forecast-job'),
+            dcc.Store(id='forecast-job-id'),
+            dcc.Interval(
+                id='forecast-job-poll', interval=500, disabled=True)
+        ]
+
+    @staticmethod
+    def render_graph(graph_id, mk_figure):
+        try:
+            return dcc.Graph(id=graph_id, figure=mk_figure())
+        except NotEnoughHistory as e:
+            return html.P(f"Not enough history to forecast from: {e}")
+
     def render(self):
         return [
             html.P("Input the number of remaining issues to reach your goal."),
             dbc.Input(
                 id="issues-input", type="number",
-                min=0, step=1,
+                min=0, max=MAX_ISSUES, step=1, debounce=True,
                 value=self.remaining_issues),
-            dcc.Graph(
-                id='throuput',
-                figure=self.mk_throughput_line()
-            ),
+            dbc.RadioItems(
+                id='forecast-mode',
+                options=[
+                    {'label': label, 'value': mode}
+                    for mode, label in MODES.items()],
+                value=self.mode,
+                inline=True),
+            self.render_graph('throuput', self.mk_throughput_line),
+            self.render_graph('issues-confidence', self.mk_confidence_chart),
+            *self.render_job_controls(),
             # dcc.Graph(
             #     id="story-points",
             #     figure=self.mk_story_point_scatter()),
@@ -172,5 +246,77 @@ class Forecast:
     @classmethod
     def callback_elements(cls):
         return [
-            dbc.Input(id='issues-input')
+            dbc.Input(id='issues-input'),
+            dbc.RadioItems(id='forecast-mode'),
+            dbc.Button(id='forecast-run'),
+            html.Div(id='forecast-job'),
+            dcc.Store(id='forecast-job-id'),
+            dcc.Interval(id='forecast-job-poll', disabled=True)
+        ]
+
+
+class PortfolioForecast:
+    def __init__(self, remaining_by_team, mode=CYCLE_TIME):
+        self.remaining_by_team = {
+            team_name: clamp_issues(remaining_issues)
+            for team_name, remaining_issues in remaining_by_team.items()
+            if clamp_issues(remaining_issues)}
+        self.mode = mode if mode in MODES else CYCLE_TIME
+
+    def mk_completion_chart(self, result):
+        names = list(result.teams) + ['All teams']
+        results = list(result.teams.values()) + [result.joint]
+        fig = go.Figure()
+        for colour, percent in zip(
+                px.colors.qualitative.Vivid, PERCENTILES):
+            fig.add_trace(go.Bar(
+                x=names,
+                y=[round(r.percentiles[percent]) for r in results],
+                name=f'{percent}%',
+                marker_color=colour))
+        fig.update_layout(
+            barmode='group',
+            yaxis_title='days')
+        return fig
+
+    def render(self):
+        if not self.remaining_by_team:
+            return [html.P(
+                "Input the remaining issues of each team to forecast.")]
+        model = PortfolioForecastModel(self.remaining_by_team)
+        try:
+            result = model.forecast(mode=self.mode)
+        except NotEnoughHistory as e:
+            return [html.P(f"Not enough history to forecast from: {e}")]
+        sketch = model.cycle_time_sketch()
+        return [
+            html.P("All teams done: " + ", ".join(
+                f"{percent}% {round(days)} days"
+                for percent, days in result.joint.percentiles.items())),
+            html.P("Days per issue across these teams: " + ", ".join(
+                f"{percent}% {round(sketch.percentile(percent))} days"
+                for percent in PERCENTILES) if sketch.count else ""),
+            dcc.Graph(
+                id='portfolio-completion',
+                figure=self.mk_completion_chart(result))
+        ]
+
+    @staticmethod
+    def render_inputs(team_names):
+        return [
+            dbc.RadioItems(
+                id='portfolio-mode',
+                options=[
+                    {'label': label, 'value': mode}
+                    for mode, label in MODES.items()],
+                value=CYCLE_TIME,
+                inline=True),
+        ] + [
+            html.Div([
+                dbc.Label(team_name),
+                dbc.Input(
+                    id={'type': 'portfolio-issues', 'team': team_name},
+                    type='number', min=0, max=MAX_ISSUES, step=1)
+            ])
+            for team_name in team_names
         ]
@@ -1,19 +1,24 @@
 import dash_table
 from dash_table.Format import Format, Scheme, Symbol
-from itertools import chain
 import plotly.express as px
 import plotly.graph_objects as go
-from plotly.subplots import make_subplots
 
 import dash_daq as daq
 import dash_bootstrap_components as dbc
 import dash_core_components as dcc
 import dash_html_components as html
 
-from .colours import WARNING, GOOD, BAD
+from colours import WARNING, GOOD, BAD
 from models import Sprints as SprintsModel
 from models import SprintReadWrite as SprintModel
-from models import Metrics as MetricsModel
+from models import SprintAuxillary as SprintAuxillaryModel
+from models import SprintIssuesPage as SprintIssuesPageModel
+from models.sprint import DETAILS_COLUMNS
+from models import TeamMetricsFigures as TeamMetricsFiguresModel
+
+
+# Issues sent to the browser at a time in the sprint details table
+DETAILS_PAGE_SIZE = 20
 
 
 def singleColRow(item):
@@ -33,26 +38,90 @@ class Sprints:
         return list(self.sprints.refs.keys())
 
 
-class Sprint:
-    empty_pie = go.Pie(labels=[], values=[])
+class SprintNotes:
+    ''' The notes panel of a sprint. Both the read only and editable
+        forms are rendered, and switched between in the browser.
+    '''
+    hidden = {'display': 'none'}
+    shown = {'display': 'block'}
 
-    def __init__(self, sprint_id, edit_notes):
-        self.model = SprintModel(sprint_id)
-        if not self.model.notes:
-            self.edit_notes = True
-        else:
-            self.edit_notes = edit_notes
+    def __init__(self, model):
+        self.model = model
 
-    def update_goal_completion(self, goal_completion_val):
-        self.model = self.model.update_goal_completion(goal_completion_val)
+    @staticmethod
+    def save_notes(sprint_id, notes):
+        SprintAuxillaryModel(sprint_id).save_notes(notes)
 
-    def save_notes(self, notes):
+    @staticmethod
+    def editable_notes(notes):
+        form_children = []
         if notes:
-            self.model = self.model.save_notes(notes)
+            form_children.append(
+                dbc.FormGroup(dbc.Textarea(
+                    className='markdown',
+                    id='notes-content', value=notes,
+                    style={'min-height': 250})))
         else:
-            # FIXME: may want to handle this using validation using
-            # FormFeedback
-            self.edit_notes = True
+            form_children.append(
+                dbc.FormGroup(dbc.Textarea(
+                    className='markdown',
+                    id='notes-content',
+                    placeholder='Write notes here in markdown format...',
+                    style={'min-height': 250})))
+        form_children.append(
+            dbc.Button("Save", id="submit-notes", color="primary"))
+        return dbc.Form(form_children)
+
+    @staticmethod
+    def read_only_notes(notes):
+        return html.Div([
+            dcc.Markdown(
+                notes,
+                id='notes-markdown',
+                className='markdown rounded border-secondary',
+                dedent=True,
+                style={
+                    'font-size': '10px',
+                    'min-height': 250,
+                    'padding': '10px',
+                    'border-style': 'solid',
+                    'border-width': '1px'
+                     }),
+            dbc.Button(
+                    "Edit",
+                    id="edit-notes",
+                    color="primary",
+                    style={'margin-top': 10}),
+            ],
+
+        )
+
+    def render(self):
+        edit_notes = not self.model.notes
+        return [
+            html.H4("Notes"),
+            html.Div(
+                id='notes-read',
+                children=self.read_only_notes(self.model.notes),
+                style=self.hidden if edit_notes else self.shown),
+            html.Div(
+                id='notes-edit',
+                children=self.editable_notes(self.model.notes),
+                style=self.shown if edit_notes else self.hidden)]
+
+
+class Sprint:
+    empty_pie = go.Pie(labels=[], values=[])
+
+    def __init__(self, sprint_id):
+        self.model = SprintModel(sprint_id)
+        self.notes = SprintNotes(self.model.auxillary)
+
+    @staticmethod
+    def update_goal_completion(sprint_id, goal_completion_val):
+        ''' Saves the goal toggle without loading the rest of the sprint '''
+        SprintAuxillaryModel(sprint_id).update_goal_completion(
+            goal_completion_val)
 
     def maybe_bau_breakdown(self):
         df = self.model.mk_bau_breakdown_df()
@@ -117,63 +186,23 @@ class Sprint:
         else:
             return header_name
 
-    @staticmethod
-    def editable_notes(notes):
-        form_children = []
-        if notes:
-            form_children.append(
-                dbc.FormGroup(dbc.Textarea(
-                    className='markdown',
-                    id='notes-content', value=notes,
-                    style={'min-height': 250})))
-        else:
-            form_children.append(
-                dbc.FormGroup(dbc.Textarea(
-                    className='markdown',
-                    id='notes-content',
-                    placeholder='Write notes here in markdown format...',
-                    style={'min-height': 250})))
-        form_children.append(
-            dbc.Button("Save", id="submit-notes", color="primary"))
-        return dbc.Form(form_children)
-
-    @staticmethod
-    def read_only_notes(notes):
-        return html.Div([
-            dcc.Markdown(
-                notes,
-                className='markdown rounded border-secondary',
-                dedent=True,
-                style={
-                    'font-size': '10px',
-                    'min-height': 250,
-                    'padding': '10px',
-                    'border-style': 'solid',
-                    'border-width': '1px'
-                     }),
-            dbc.Button(
-                    "Edit",
-                    id="edit-notes",
-                    color="primary",
-                    style={'margin-top': 10}),
-            ],
-
-        )
-
     def details_table(self):
-        df = self.model.issues_df[[
-            'name', 'description',
-            'planned', 'finished_in_sprint', 'bau']]
-        df = df.rename(columns={
-            'finished_in_sprint': 'delivered',
-            })
-
+        records, page_count = self.model.mk_details_page(DETAILS_PAGE_SIZE)
+        # Paged, sorted and filtered on the server, see details_page
         fig = dash_table.DataTable(
+            id='sprint-details',
             columns=(
-                [{'name': i, "id": i} for i in df.columns]),
-            data=df.to_dict('records'),
-            sort_action='native',
-            filter_action='native',
+                [{'name': i, "id": i} for i in DETAILS_COLUMNS]),
+            data=records,
+            page_current=0,
+            page_size=DETAILS_PAGE_SIZE,
+            page_count=page_count,
+            page_action='custom',
+            sort_action='custom',
+            sort_mode='multi',
+            sort_by=[],
+            filter_action='custom',
+            filter_query='',
             # fixed_rows={'headers': True},
             # style_as_list_view=True,
             style_table={
@@ -229,6 +258,14 @@ class Sprint:
             )
         return fig
 
+    @staticmethod
+    def details_page(
+            sprint_id, page_current, page_size, sort_by, filter_query):
+        ''' The details table rows and page count for a page '''
+        page = SprintIssuesPageModel(
+            sprint_id, page_current, page_size, sort_by, filter_query)
+        return page.records, page.page_count
+
     def render(self):
         bau_breakdown = self.maybe_bau_breakdown()
         dom_nodes = [
@@ -251,28 +288,8 @@ class Sprint:
                 style={'padding-top': 20, 'padding-bottom': 20}
                 )),
         ]
-        # FIXME: When in edit mode we have to add a hidden Div representing
-        # the edit button from read only mode, and visa versa.
-        # If we don't we get callback errors for which ever button doesn't
-        # exist. There should be a better way to account for conditionally
-        # rendered dom nodes.
-        if self.edit_notes:
-            row_children = [
-                dbc.Col([
-                    html.H4("Notes"),
-                    self.editable_notes(self.model.notes),
-                    html.Div(id="edit-notes", hidden=True)],
-                    width=6
-                )]
-        else:
-            row_children = [
-                dbc.Col([
-                    html.H4("Notes"),
-                    self.read_only_notes(self.model.notes),
-                    html.Div(id="submit-notes", hidden=True),
-                    html.Div(id="notes-content", hidden=True)],
-                    width=6
-                )]
+        row_children = [
+            dbc.Col(self.notes.render(), width=6)]
 
         if bau_breakdown:
             row_children.append(
@@ -308,72 +325,16 @@ class Sprint:
         '''
         return [
             daq.BooleanSwitch(id='goal-completion-toggle'),
+            html.Div(id='notes-read'),
+            html.Div(id='notes-edit'),
+            dcc.Markdown(id='notes-markdown'),
             dbc.Button(id='edit-notes'),
             dbc.Button(id='submit-notes'),
-            dbc.Textarea(id='notes-content')
+            dbc.Textarea(id='notes-content'),
+            dash_table.DataTable(id='sprint-details')
         ]
 
 
-def _mk_sub_pie_trace(series):
-    empty_sub_pie = go.Pie(
-        labels=[], values=[], scalegroup='one')
-    if series.empty:
-        return empty_sub_pie
-
-    df = series.value_counts().to_frame('issue_count')
-    pie = px.pie(
-        df,
-        values='issue_count',
-        names=df.index)
-    # can only make subplots from graph objects
-    return go.Pie(
-        labels=pie.data[0]['labels'],
-        values=pie.data[0]['values'],
-        scalegroup='one')
-
-
-def _mk_sub_bar_trace(
-        df, name, x_col, y_col, color='blue', show_legend=False):
-    fig = go.Bar(
-        x=df[x_col].tolist(),
-        y=df[y_col].tolist(),
-        name=name,
-        marker={'color': color},
-        showlegend=show_legend,
-        legendgroup=name)
-    return fig
-
-
-def _mk_sub_line_trace(
-        df, name, x_col, y_col, color='blue', show_legend=False):
-    fig = go.Scatter(
-        x=df[x_col].tolist(),
-        y=df[y_col].tolist(),
-        name=name,
-        marker={'color': color},
-        showlegend=show_legend,
-        legendgroup=name)
-    return fig
-
-
-def mk_gauge_trace(df):
-    val = int(df.goal_completed.mean().round(0))
-    if val < 60:
-        color = 'red'
-    elif val < 80:
-        color = 'orange'
-    else:
-        color = 'green'
-    fig = go.Indicator(
-        value=val,
-        number={'font': {'color': color}},
-        title={
-            'text': "Goal Completion %",
-            'font': {'size': 12}}
-    )
-    return fig
-
-
 def chunk(iterable, chunk_size=1):
     iterator = iter(iterable)
 
@@ -390,145 +351,47 @@ def chunk(iterable, chunk_size=1):
 
 
 class Metrics:
-    def __init__(self, team_names):
-        self.model = MetricsModel()
-
-    def mk_bau_overview_figure(self):
-        df = self.model.sprint_bau_report_df()
-        df = df.sort_values(['team_name', 'start_date'])
-        team_names = df.team_name.unique()
-
-        plots = len(team_names)
-        cols = 3
-        rows, rem = divmod(plots, cols)
-        rows += rem
-
-        fig = make_subplots(
-            rows=rows, cols=cols,
-            subplot_titles=[name for name in team_names],
-            specs=[
-                [{'type': 'domain'} for _ in range(cols)]
-                for _ in range(rows)])
-
-        for i, (_, group) in enumerate(df.groupby("team_name")):
-            div, rem = divmod(i, cols)
-            fig.add_trace(
-                _mk_sub_pie_trace(
-                    group.bau_summary.explode("bau_summary").dropna()
-                ),
-                row=div + 1, col=rem + 1)
-
-        fig.update_layout(
-            legend_x=1,
-            legend_y=1,
-            margin=dict(t=0, b=0, r=0, l=0))
-        fig.update_traces(
-            textinfo='percent', showlegend=True)
-        fig.update_layout(transition_duration=500)
-        return fig
-
-    @staticmethod
-    def add_sprint_delivery_traces(df, row, col, show_legend, fig):
-        fig.add_trace(
-            _mk_sub_line_trace(
-                df,
-                name='BAU %',
-                x_col='end_date',
-                y_col='bau_issues_percentage',
-                color='orange',
-                show_legend=show_legend),
-            row=row, col=col)
-        fig.add_trace(
-            _mk_sub_line_trace(
-                df,
-                name='Delivery %',
-                x_col='end_date',
-                y_col='roadmap_delivered_issues_percentage',
-                color=GOOD,
-                show_legend=show_legend),
-            row=row, col=col)
-        fig.add_trace(
-            _mk_sub_bar_trace(
-                df,
-                name='Goal completed',
-                x_col='end_date',
-                y_col='goal_completed',
-                color='#90ee90',
-                show_legend=show_legend),
-            row=row, col=col)
+    ''' The Metrics page, a panel per team. Each panel is drawn by its
+        own callback once the browser has scrolled it into view, so the
+        teams load in parallel and only when they are looked at.
+    '''
+    cols = 3
+    # How often the browser checks whether an empty panel is visible
+    poll_interval = 250
 
-    @staticmethod
-    def add_gauge_trace(df, row, col, fig):
-        fig.add_trace(mk_gauge_trace(df), row, col)
+    def __init__(self, team_names):
+        self.team_names = list(team_names)
 
-    @staticmethod
-    def _gen_titles(df, cols):
-        teams = df['team_name'].unique()
-        for i in range(0, len(teams), cols):
-            yield list(teams[i: i + 3])
-            yield [None] * cols
+    def render_panel(self, team_name):
+        return dbc.Col([
+            html.H4(team_name),
+            html.Div(
+                id={'type': 'metrics-panel', 'team': team_name},
+                children=dbc.Spinner(color='primary'),
+                style={'min-height': 700}),
+            dcc.Store(id={'type': 'metrics-visible', 'team': team_name}),
+            dcc.Interval(
+                id={'type': 'metrics-poll', 'team': team_name},
+                interval=self.poll_interval)
+            ], width=12 // self.cols)
 
-    @staticmethod
-    def _gen_specs(df, cols):
-        teams = df['team_name'].unique()
-        for _ in range(0, len(teams), cols):
-            yield [{}] * cols
-            yield [{'type': 'indicator'}] * cols
+    def render(self):
+        return dbc.Col([
+            singleColRow(html.H2('KPIs and BAU overview')),
+            *(
+                dbc.Row([self.render_panel(name) for name in team_names])
+                for team_names in chunk(self.team_names, self.cols)
+                if team_names)
+            ])
 
-    @staticmethod
-    def _gen_heights(df, cols):
-        teams = df['team_name'].unique()
-        for _ in range(0, len(teams), cols):
-            yield 0.7
-            yield 0.3
-
-    def mk_delivery_summary_figure(self):
-        df = self.model.sprint_performance_report_df()
-        df = df.sort_values(['team_name', 'start_date'])
-        cols = 3
-
-        titles = list(self._gen_titles(df, cols))
-        specs = list(self._gen_specs(df, cols))
-        heights = list(self._gen_heights(df, cols))
-
-        fig = make_subplots(
-            rows=len(specs), cols=cols,
-            subplot_titles=list(chain.from_iterable(titles)),
-            specs=specs,
-            row_heights=heights)
-
-        for row_base, groups_chunk in enumerate(
-               chunk(df.groupby('team_name'), cols),
-               start=1):
-            row_above = row_base + row_base - 1
-            row_below = row_above + 1
-
-            for col, (_, group_df) in enumerate(groups_chunk, start=1):
-                if row_above == 1 and col == 1:
-                    show_legend = True
-                else:
-                    show_legend = False
-
-                self.add_sprint_delivery_traces(
-                    group_df, row_above, col, show_legend, fig)
-                self.add_gauge_trace(group_df, row_below, col, fig)
 
-        fig.update_layout(
-            legend_x=1,
-            legend_y=1,
-            height=600,
-            margin=dict(t=20, b=20, r=0, l=0),
-            )
-        fig.update_layout(transition_duration=500)
-        for ax in fig['layout']:
-            if ax.startswith('yaxis'):
-                fig['layout'][ax]['ticksuffix'] = '%'
-        return fig
+class TeamMetrics:
+    def __init__(self, team_name):
+        self.model = TeamMetricsFiguresModel(team_name)
 
     def render(self):
-        return dbc.Col([
-            singleColRow(html.H2('KPIs')),
-            singleColRow(dcc.Graph(figure=self.mk_delivery_summary_figure())),
-            singleColRow(html.H2('BAU overview')),
-            singleColRow(dcc.Graph(figure=self.mk_bau_overview_figure()))
-            ])
+        figures = self.model.figures()
+        return [
+            dcc.Graph(figure=figures['delivery']),
+            dcc.Graph(figure=figures['bau'])
+            ]